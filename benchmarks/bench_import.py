@@ -0,0 +1,58 @@
+'''
+measure startup time of importing the package and loading tokenizers, each case runs in a fresh process.
+
+usage:
+    python benchmarks/bench_import.py --repeat 5
+    python benchmarks/bench_import.py --max-import-ms 100  # exit with 1 if `import sqlalchemy_vectorstores` is slower
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+CASES = [
+    ("import package", "import sqlalchemy_vectorstores"),
+    ("import sqlite", "from sqlalchemy_vectorstores import SqliteDatabase, SqliteVectorStore"),
+    ("import all", "import sqlalchemy_vectorstores as m; [getattr(m, x) for x in m.__all__]"),
+    ("jieba construct", "from sqlalchemy_vectorstores import JiebaTokenize; JiebaTokenize(cache_file={cache_file!r})"),
+    ("jieba first cut", "from sqlalchemy_vectorstores import JiebaTokenize; "
+                        "JiebaTokenize(cache_file={cache_file!r}).lcut_words('向量检索和全文检索')"),
+]
+
+
+def run(code: str, repeat: int) -> list[float]:
+    res = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+        res.append((time.perf_counter() - start) * 1000)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=0, help="fail if `import package` is slower than it")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = str(Path(tmp_dir) / "jieba.cache")
+        base = statistics.median(run("pass", args.repeat))
+        print(f"{'python startup':<16} median: {base:8.1f} ms")
+        result = {}
+        for name, code in CASES:
+            times = run(code.format(cache_file=cache_file), args.repeat)
+            result[name] = statistics.median(times) - base
+            print(f"{name:<16} median: {result[name]:8.1f} ms  min: {min(times) - base:8.1f} ms")
+
+    if args.max_import_ms and result["import package"] > args.max_import_ms:
+        print(f"import package is slower than {args.max_import_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
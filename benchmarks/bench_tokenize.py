@@ -0,0 +1,72 @@
+'''
+measure throughput (tokens/s) of JiebaTokenize.cut_words on chinese, english and mixed text.
+
+usage:
+    python benchmarks/bench_tokenize.py --repeat 200 --stop-words 1000
+    python benchmarks/bench_tokenize.py --processes 4 --docs 5000  # also batch_to_tsvector in worker processes
+'''
+import argparse
+import time
+
+from sqlalchemy_vectorstores import JiebaTokenize
+
+
+TEXTS = {
+    "chinese": "sqlalchemy-vectorstores 是一个通过 sqlalchemy 利用 sqlite 和 postgres 数据库实现向量检索和 BM25 全文检索功能的库。"
+               "定期安全审查的范围包括核电厂核安全的所有方面，包括核电厂运行许可证所覆盖的处在厂区内的构筑物、系统和部件及其运行。",
+    "english": "Alaqua Cox is a Native American (Menominee) actress. George V was King of the United Kingdom and the British "
+               "Dominions, and Emperor of India, from 6 May 1910 until his death in 1936.",
+    "mixed": "Capri-Sun 是德国 Wild 公司生产的果汁饮料品牌，Shohei Ohtani 是 Los Angeles Dodgers 的日本职业棒球运动员，"
+             "the library supports BM25 全文检索 and vector search 向量检索.",
+}
+
+
+def run(tokenize: JiebaTokenize, text: str, repeat: int) -> float:
+    tokens = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _ in tokenize.cut_words(text):
+            tokens += 1
+    return tokens / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--stop-words", type=int, default=1000, help="number of stop words")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes of batch_to_tsvector")
+    parser.add_argument("--docs", type=int, default=5000, help="number of documents of batch_to_tsvector")
+    args = parser.parse_args()
+
+    stop_words = ["的", "是", "和", "the", "is", "a"] + [f"stop{i}" for i in range(args.stop_words)]
+    for hmm in [True, False]:
+        tokenize = JiebaTokenize(stop_words=stop_words, hmm=hmm)
+        tokenize.initialize()
+        for name, text in TEXTS.items():
+            run(tokenize, text, 1)  # warm up jieba caches
+            print(f"hmm: {hmm!s:<6} {name:<8} tokens/s: {run(tokenize, text, args.repeat):.0f}")
+
+    # repeated queries are served by the words cache
+    query = "核电厂定期安全审查的要素"
+    for cache_size in [0, 1024]:
+        tokenize = JiebaTokenize(stop_words=stop_words, cache_size=cache_size)
+        tokenize.initialize()
+        start = time.perf_counter()
+        for _ in range(args.repeat * 10):
+            tokenize.cut_for_search(query)
+        print(f"cut_for_search cache_size: {cache_size:<5} queries/s: {args.repeat * 10 / (time.perf_counter() - start):.0f} "
+              f"hit_rate: {tokenize.cache_stats()['hit_rate']:.3f}")
+
+    if args.processes:
+        texts = list(TEXTS.values()) * (args.docs // len(TEXTS))
+        for processes in [0, args.processes]:
+            tokenize = JiebaTokenize(stop_words=stop_words, processes=processes)
+            tokenize.batch_to_tsvector(texts[:tokenize.min_batch_size])  # start workers
+            start = time.perf_counter()
+            tokenize.batch_to_tsvector(texts)
+            print(f"batch_to_tsvector processes: {processes:<3} docs/s: {len(texts) / (time.perf_counter() - start):.0f}")
+            tokenize.close()
+
+
+if __name__ == "__main__":
+    main()
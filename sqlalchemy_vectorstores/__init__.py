@@ -1,8 +1,38 @@
-from .databases import BaseDatabase, SqliteDatabase, PostgresDatabase, AsyncSqliteDatabase, AsyncPostgresDatabase
-from .vectorstores import BaseVectorStore, SqliteVectorStore, PostgresVectorStore, AsyncSqliteVectorStore, AsyncPostgresVectorStore
-from .vectorstores.utils import DocType
-from .prebuilt import create_embedding_func, create_postgres_store_zh, create_sqlite_store_zh
-from .tokenizers import JiebaTokenize
+from __future__ import annotations
+
+import typing as t
+
+from ._lazy import lazy_attrs
+
+if t.TYPE_CHECKING:
+    from .databases import BaseDatabase, SqliteDatabase, PostgresDatabase, AsyncSqliteDatabase, AsyncPostgresDatabase
+    from .vectorstores import BaseVectorStore, SqliteVectorStore, PostgresVectorStore, AsyncSqliteVectorStore, AsyncPostgresVectorStore
+    from .vectorstores.utils import DocType
+    from .prebuilt import create_embedding_func, create_postgres_store_zh, create_sqlite_store_zh
+    from .tokenizers import JiebaTokenize
 
 
 __version__ = "0.1.4"
+
+
+# public names are imported on first access, so `import sqlalchemy_vectorstores` doesn't load sqlalchemy or drivers.
+_LAZY_IMPORTS = {
+    "BaseDatabase": ".databases.base",
+    "SqliteDatabase": ".databases.sqlite",
+    "PostgresDatabase": ".databases.postgres",
+    "AsyncSqliteDatabase": ".databases.sqlite_async",
+    "AsyncPostgresDatabase": ".databases.postgres_async",
+    "BaseVectorStore": ".vectorstores.base",
+    "SqliteVectorStore": ".vectorstores.sqlite",
+    "PostgresVectorStore": ".vectorstores.postgres",
+    "AsyncSqliteVectorStore": ".vectorstores.sqlite_async",
+    "AsyncPostgresVectorStore": ".vectorstores.postgres_async",
+    "DocType": ".vectorstores.utils",
+    "create_embedding_func": ".prebuilt",
+    "create_postgres_store_zh": ".prebuilt",
+    "create_sqlite_store_zh": ".prebuilt",
+    "JiebaTokenize": ".tokenizers.jieba_tokenize",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+__getattr__, __dir__ = lazy_attrs(__name__, _LAZY_IMPORTS)
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import importlib
+import typing as t
+
+
+def lazy_attrs(
+    package: str,
+    attrs: t.Dict[str, str],
+) -> t.Tuple[t.Callable[[str], t.Any], t.Callable[[], t.List[str]]]:
+    '''
+    make module level `__getattr__` and `__dir__` of a package,
+    `attrs` maps public names to modules relative to the package, which are imported on first access.
+    '''
+    def __getattr__(name: str) -> t.Any:
+        if name not in attrs:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        module = importlib.import_module(attrs[name], package)
+        value = getattr(module, name)
+        setattr(importlib.import_module(package), name, value)
+        return value
+
+    def __dir__() -> t.List[str]:
+        return sorted([*vars(importlib.import_module(package)), *attrs])
+
+    return __getattr__, __dir__
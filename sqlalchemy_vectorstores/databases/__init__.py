@@ -1,6 +1,26 @@
-from .base import BaseDatabase
-from .base_async import AsyncBaseDatabase
-from .sqlite import SqliteDatabase
-from .sqlite_async import AsyncSqliteDatabase
-from .postgres import PostgresDatabase
-from .postgres_async import AsyncPostgresDatabase
+from __future__ import annotations
+
+import typing as t
+
+from sqlalchemy_vectorstores._lazy import lazy_attrs
+
+if t.TYPE_CHECKING:
+    from .base import BaseDatabase
+    from .base_async import AsyncBaseDatabase
+    from .sqlite import SqliteDatabase
+    from .sqlite_async import AsyncSqliteDatabase
+    from .postgres import PostgresDatabase
+    from .postgres_async import AsyncPostgresDatabase
+
+
+_LAZY_IMPORTS = {
+    "BaseDatabase": ".base",
+    "AsyncBaseDatabase": ".base_async",
+    "SqliteDatabase": ".sqlite",
+    "AsyncSqliteDatabase": ".sqlite_async",
+    "PostgresDatabase": ".postgres",
+    "AsyncPostgresDatabase": ".postgres_async",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+__getattr__, __dir__ = lazy_attrs(__name__, _LAZY_IMPORTS)
@@ -1,17 +1,73 @@
 from __future__ import annotations
 
 import abc
+import re
 import uuid
 import typing as t
 
 import sqlalchemy as sa
-from sqlalchemy_utils import ScalarListType
+
+
+def _index_suffix(path: str) -> str:
+    return re.sub(r"\W+", "_", path).strip("_").lower()
+
+
+def _is_like_pattern(value: str) -> bool:
+    # "_" is common in file names and snake_case values, only "%" makes a pattern
+    return "%" in value
+
+
+def _add_missing_columns(con: sa.Connection, table: sa.Table) -> t.List[str]:
+    '''
+    ALTER TABLE ADD COLUMN for columns of table missing in database, return names of the added columns
+    '''
+    existed = {x["name"] for x in sa.inspect(con).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name not in existed:
+            ddl = sa.schema.CreateColumn(column).compile(dialect=con.dialect)
+            con.execute(sa.text(f"ALTER TABLE {con.dialect.identifier_preparer.quote(table.name)} ADD COLUMN {ddl}"))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _compare(expr: sa.ColumnElement, op: str, value: t.Any) -> sa.ColumnElement:
+    '''
+    build comparison expression by filter operator, with or without the "$" prefix
+    '''
+    op = op.lstrip("$")
+    if op == "eq":
+        return (expr == value)
+    elif op == "ne":
+        return (expr != value)
+    elif op == "gt":
+        return (expr > value)
+    elif op == "gte":
+        return (expr >= value)
+    elif op == "lt":
+        return (expr < value)
+    elif op == "lte":
+        return (expr <= value)
+    elif op == "in":
+        return (expr.in_(list(value)))
+    elif op == "nin":
+        return (expr.not_in(list(value)))
+    elif op == "like":
+        return (expr.like(value))
+    elif op == "ilike":
+        return (expr.ilike(value))
+    elif op == "exists":
+        return (expr.is_not(None) if value else expr.is_(None))
+    else:
+        raise RuntimeError(f"unsupported filter operator: {op}")
 
 
 class BaseDatabase(abc.ABC):
     '''
     manage table creation and connection in database
     '''
+    # id sets longer than this are bound as one parameter by make_ids_filter
+    max_in_ids: int = 100
 
     def __init__(
         self,
@@ -24,6 +80,8 @@ class BaseDatabase(abc.ABC):
         else:
             self.engine: sa.Engine = sa.create_engine(db, **db_kwds)
         self.metadata = sa.MetaData()
+        # (table name, json path) -> index type, used by make_filter to build index compatible expressions
+        self._metadata_indexes: t.Dict[t.Tuple[str, str], str] = {}
 
     @property
     def tables(self) -> t.Dict[str, sa.Table]:
@@ -51,17 +109,61 @@ class BaseDatabase(abc.ABC):
             if isinstance(table, str):
                 table = self.tables[table]
             c = getattr(table.c, id_name)
-            res = con.execute(sa.delete(table).where(c.in_(ids)))
+            res = con.execute(sa.delete(table).where(self.make_ids_filter(c, ids)))
             con.commit()
             return res.rowcount
 
-    def create_src_table(self, table_name: str) -> sa.Table:
+    def list_indexes(self, table_name: str) -> t.List[t.Dict]:
+        '''
+        indexes exist in database of a table
+        '''
+        with self.connect() as con:
+            return sa.inspect(con).get_indexes(table_name)
+
+    def _index_names(self, con: sa.Connection, table_name: str) -> t.Set[str]:
+        return {x["name"] for x in sa.inspect(con).get_indexes(table_name)}
+
+    def ensure_indexes(self, *table_names: str) -> t.List[str]:
+        '''
+        create indexes defined on tables but missing in database, such as tables created by older versions.
+        return names of the created indexes
+        '''
+        created = []
+        with self.connect() as con:
+            for table_name in table_names:
+                table = self.tables.get(table_name)
+                if table is None or not table.indexes:
+                    continue
+                existed = self._index_names(con, table_name)
+                for index in table.indexes:
+                    if index.name not in existed:
+                        index.create(con)
+                        created.append(index.name)
+            con.commit()
+        return created
+
+    def ensure_columns(self, *table_names: str) -> t.List[str]:
+        '''
+        add columns defined on tables but missing in database, such as tables created by older versions.
+        virtual tables (fts, vec) are not supported. return names of the added columns: "table.column"
+        '''
+        added = []
+        with self.connect() as con:
+            for table_name in table_names:
+                if (table := self.tables.get(table_name)) is not None:
+                    added += _add_missing_columns(con, table)
+            con.commit()
+        return added
+
+    def create_src_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document source
         '''
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -72,16 +174,19 @@ class BaseDatabase(abc.ABC):
             sa.Column("tags", ScalarListType(), default=[]),
             sa.Column("metadata", sa.JSON, default={}),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
-    def create_doc_table(self, table_name: str) -> sa.Table:
+    def create_doc_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document chunks
         '''
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -92,8 +197,13 @@ class BaseDatabase(abc.ABC):
             sa.Column("target_ids", ScalarListType(), default=[]),
             sa.Column("seq", sa.Integer),
             sa.Column("metadata", sa.JSON, default={}),
+            sa.Column("word_count", sa.Integer),
+            sa.Index(f"idx_{table_name}_src_id_seq", "src_id", "seq"),
+            sa.Index(f"idx_{table_name}_type", "type"),
+            sa.Index(f"idx_{table_name}_word_count", "word_count"),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
     @abc.abstractmethod
@@ -102,6 +212,7 @@ class BaseDatabase(abc.ABC):
         table_name: str,
         source_table: str,
         tokenize: str | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
         '''
         table for full text search
@@ -114,13 +225,66 @@ class BaseDatabase(abc.ABC):
         table_name: str,
         source_table: str,
         dim: int | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
         '''
         table for vector search
         '''
         ...
 
-    def create_words_table(self, table_name: str):
+    @abc.abstractmethod
+    def create_metadata_index(
+        self,
+        table_name: str,
+        path: str = "",
+        type: t.Literal["text", "number", "gin"] = "text",
+    ) -> str:
+        '''
+        index a path of the metadata column, so metadata filters built by make_filter can use it.
+        return the index name
+        '''
+        ...
+
+    def _metadata_index_type(self, column: sa.Column, path: str) -> str | None:
+        return self._metadata_indexes.get((column.table.name, path))
+
+    def create_tag_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        normalized source tags, one row per (src_id, tag)
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("src_id", sa.String(36), primary_key=True),
+            sa.Column("tag", sa.String(100), primary_key=True),
+            sa.Index(f"idx_{table_name}_tag", "tag", "src_id"),
+        )
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
+        return table
+
+    def create_edge_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        normalized target_ids of documents, one row per (doc_id, target_id)
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("doc_id", sa.String(36), primary_key=True),
+            sa.Column("target_id", sa.String(36), primary_key=True),
+            sa.Index(f"idx_{table_name}_target_id", "target_id", "doc_id"),
+        )
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
+        return table
+
+    def create_words_table(self, table_name: str, emit_ddl: bool = True):
         if table_name in self.tables:
             return self.tables[table_name]
 
@@ -132,10 +296,90 @@ class BaseDatabase(abc.ABC):
             sa.Column("tag", sa.String(10)),
             sa.Column("metadata", sa.JSON),
             sa.Column("status", sa.Integer), # null: not used; 0: stop word, 1: user dict
+            sa.Column("version", sa.Integer), # increased on every change, for tokenizers to load changed words only
+            sa.Index(f"idx_{table_name}_version", "version"),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
+    def create_manifest_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        settings of a vector store (dim, embedding model, table names, ...) in one row,
+        so the store can be opened without probing the embedding dim or checking tables.
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("schema_version", sa.Integer),
+            sa.Column("dim", sa.Integer),
+            sa.Column("embedding_model", sa.String(255)),
+            sa.Column("fts_tokenize", sa.String(255)),
+            sa.Column("tables", sa.JSON),
+            sa.Column("metadata", sa.JSON),
+            sa.Column("update_time", sa.DateTime, server_default=sa.func.now()),
+        )
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
+        return table
+
+    def make_ids_filter(
+        self,
+        column: sa.Column,
+        ids: t.Iterable[str | int],
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        '''
+        filter column by a set of ids, used by lookups, deletions and "$in" filters.
+        short sets use IN with a parameter per id, databases bind long sets as one parameter,
+        so they don't hit the variable limit or fill the statement cache.
+        '''
+        return (column.in_(list(ids)))
+
+    def lock_table(self, con: sa.Connection, table: sa.Table):
+        '''
+        block other writers of table until the transaction of con ends, reads are not blocked.
+        a no-op update takes the write lock of databases locking on write, such as sqlite.
+        '''
+        c = list(table.primary_key)[0]
+        con.execute(sa.update(table).where(sa.false()).values({c: c}))
+
+    @abc.abstractmethod
+    def make_fts_query(self, words: t.Iterable[str]) -> str:
+        '''
+        build a full text query matching any of words, each word is quoted as a phrase.
+        '''
+        ...
+
+    def make_json_filter(
+        self,
+        column: sa.Column,
+        path: str,
+        op: str,
+        value: t.Any,
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        '''
+        compare a path of json column with value by operator: eq, ne, gt, gte, lt, lte, in, nin, like, ilike, exists.
+        unlike make_filter, strings are compared exactly unless like/ilike is used.
+        '''
+        if op.lstrip("$") == "exists":
+            sample = None
+        elif isinstance(value, (list, tuple)):
+            sample = value[0] if value else None
+        else:
+            sample = value
+        return _compare(self._json_expr(column, path, sample), op, value)
+
+    @abc.abstractmethod
+    def _json_expr(self, column: sa.Column, path: str, value: t.Any = None) -> sa.ColumnElement:
+        '''
+        expression of a json path to compare with value, should be same as the metadata index expression.
+        '''
+        ...
+
     @abc.abstractmethod
     def make_filter(
         self,
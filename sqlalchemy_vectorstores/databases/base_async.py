@@ -6,13 +6,18 @@ import typing as t
 
 import sqlalchemy as sa
 from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
-from sqlalchemy_utils import ScalarListType
+
+from .base import _add_missing_columns, _compare
 
 
 class AsyncBaseDatabase(abc.ABC):
     '''
     manage table creation and connection in database
     '''
+    # id sets longer than this are bound as one parameter by make_ids_filter
+    max_in_ids: int = 100
+    # whether tables can be created concurrently in different connections
+    concurrent_ddl: bool = False
 
     def __init__(
         self,
@@ -25,6 +30,8 @@ class AsyncBaseDatabase(abc.ABC):
         else:
             self.engine: AsyncEngine = create_async_engine(db, **db_kwds)
         self.metadata = sa.MetaData()
+        # (table name, json path) -> index type, used by make_filter to build index compatible expressions
+        self._metadata_indexes: t.Dict[t.Tuple[str, str], str] = {}
 
     @property
     def tables(self) -> t.Dict[str, sa.Table]:
@@ -52,17 +59,69 @@ class AsyncBaseDatabase(abc.ABC):
             if isinstance(table, str):
                 table = self.tables[table]
             c = getattr(table.c, id_name)
-            res = await con.execute(sa.delete(table).where(c.in_(ids)))
+            res = await con.execute(sa.delete(table).where(self.make_ids_filter(c, ids)))
             await con.commit()
             return res.rowcount
 
-    async def create_src_table(self, table_name: str) -> sa.Table:
+    async def list_indexes(self, table_name: str) -> t.List[t.Dict]:
+        '''
+        indexes exist in database of a table
+        '''
+        async with self.connect() as con:
+            return await con.run_sync(lambda x: sa.inspect(x).get_indexes(table_name))
+
+    def _index_names(self, con: sa.Connection, table_name: str) -> t.Set[str]:
+        return {x["name"] for x in sa.inspect(con).get_indexes(table_name)}
+
+    async def ensure_indexes(self, *table_names: str) -> t.List[str]:
+        '''
+        create indexes defined on tables but missing in database, such as tables created by older versions.
+        return names of the created indexes
+        '''
+        def _ensure(con: sa.Connection) -> t.List[str]:
+            created = []
+            for table_name in table_names:
+                table = self.tables.get(table_name)
+                if table is None or not table.indexes:
+                    continue
+                existed = self._index_names(con, table_name)
+                for index in table.indexes:
+                    if index.name not in existed:
+                        index.create(con)
+                        created.append(index.name)
+            return created
+
+        async with self.connect() as con:
+            created = await con.run_sync(_ensure)
+            await con.commit()
+        return created
+
+    async def ensure_columns(self, *table_names: str) -> t.List[str]:
+        '''
+        add columns defined on tables but missing in database, such as tables created by older versions.
+        virtual tables (fts, vec) are not supported. return names of the added columns: "table.column"
+        '''
+        def _ensure(con: sa.Connection) -> t.List[str]:
+            added = []
+            for table_name in table_names:
+                if (table := self.tables.get(table_name)) is not None:
+                    added += _add_missing_columns(con, table)
+            return added
+
+        async with self.connect() as con:
+            added = await con.run_sync(_ensure)
+            await con.commit()
+        return added
+
+    async def create_src_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document source
         '''
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -73,17 +132,20 @@ class AsyncBaseDatabase(abc.ABC):
             sa.Column("tags", ScalarListType(), default=[]),
             sa.Column("metadata", sa.JSON, default={}),
         )
-        async with self.connect() as con:
-            await con.run_sync(table.create, checkfirst=True)
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
         return table
 
-    async def create_doc_table(self, table_name: str) -> sa.Table:
+    async def create_doc_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document chunks
         '''
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -94,9 +156,14 @@ class AsyncBaseDatabase(abc.ABC):
             sa.Column("target_ids", ScalarListType(), default=[]),
             sa.Column("seq", sa.Integer),
             sa.Column("metadata", sa.JSON, default={}),
+            sa.Column("word_count", sa.Integer),
+            sa.Index(f"idx_{table_name}_src_id_seq", "src_id", "seq"),
+            sa.Index(f"idx_{table_name}_type", "type"),
+            sa.Index(f"idx_{table_name}_word_count", "word_count"),
         )
-        async with self.connect() as con:
-            await con.run_sync(table.create, checkfirst=True)
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
         return table
 
     @abc.abstractmethod
@@ -105,6 +172,7 @@ class AsyncBaseDatabase(abc.ABC):
         table_name: str,
         source_table: str,
         tokenize: str | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
         '''
         table for full text search
@@ -117,13 +185,68 @@ class AsyncBaseDatabase(abc.ABC):
         table_name: str,
         source_table: str,
         dim: int | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
         '''
         table for vector search
         '''
         ...
 
-    async def create_words_table(self, table_name: str):
+    @abc.abstractmethod
+    async def create_metadata_index(
+        self,
+        table_name: str,
+        path: str = "",
+        type: t.Literal["text", "number", "gin"] = "text",
+    ) -> str:
+        '''
+        index a path of the metadata column, so metadata filters built by make_filter can use it.
+        return the index name
+        '''
+        ...
+
+    def _metadata_index_type(self, column: sa.Column, path: str) -> str | None:
+        return self._metadata_indexes.get((column.table.name, path))
+
+    async def create_tag_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        normalized source tags, one row per (src_id, tag)
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("src_id", sa.String(36), primary_key=True),
+            sa.Column("tag", sa.String(100), primary_key=True),
+            sa.Index(f"idx_{table_name}_tag", "tag", "src_id"),
+        )
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
+        return table
+
+    async def create_edge_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        normalized target_ids of documents, one row per (doc_id, target_id)
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("doc_id", sa.String(36), primary_key=True),
+            sa.Column("target_id", sa.String(36), primary_key=True),
+            sa.Index(f"idx_{table_name}_target_id", "target_id", "doc_id"),
+        )
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
+        return table
+
+    async def create_words_table(self, table_name: str, emit_ddl: bool = True):
         if table_name in self.tables:
             return self.tables[table_name]
 
@@ -135,11 +258,92 @@ class AsyncBaseDatabase(abc.ABC):
             sa.Column("tag", sa.String(10)),
             sa.Column("metadata", sa.JSON),
             sa.Column("status", sa.Integer), # null: not used; 0: stop word, 1: user dict
+            sa.Column("version", sa.Integer), # increased on every change, for tokenizers to load changed words only
+            sa.Index(f"idx_{table_name}_version", "version"),
         )
-        async with self.connect() as con:
-            await con.run_sync(table.create, checkfirst=True)
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
+        return table
+
+    async def create_manifest_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
+        '''
+        settings of a vector store (dim, embedding model, table names, ...) in one row,
+        so the store can be opened without probing the embedding dim or checking tables.
+        '''
+        if table_name in self.tables:
+            return self.tables[table_name]
+
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("schema_version", sa.Integer),
+            sa.Column("dim", sa.Integer),
+            sa.Column("embedding_model", sa.String(255)),
+            sa.Column("fts_tokenize", sa.String(255)),
+            sa.Column("tables", sa.JSON),
+            sa.Column("metadata", sa.JSON),
+            sa.Column("update_time", sa.DateTime, server_default=sa.func.now()),
+        )
+        if emit_ddl:
+            async with self.connect() as con:
+                await con.run_sync(table.create, checkfirst=True)
         return table
 
+    def make_ids_filter(
+        self,
+        column: sa.Column,
+        ids: t.Iterable[str | int],
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        '''
+        filter column by a set of ids, used by lookups, deletions and "$in" filters.
+        short sets use IN with a parameter per id, databases bind long sets as one parameter,
+        so they don't hit the variable limit or fill the statement cache.
+        '''
+        return (column.in_(list(ids)))
+
+    async def lock_table(self, con: AsyncConnection, table: sa.Table):
+        '''
+        block other writers of table until the transaction of con ends, reads are not blocked.
+        a no-op update takes the write lock of databases locking on write, such as sqlite.
+        '''
+        c = list(table.primary_key)[0]
+        await con.execute(sa.update(table).where(sa.false()).values({c: c}))
+
+    @abc.abstractmethod
+    def make_fts_query(self, words: t.Iterable[str]) -> str:
+        '''
+        build a full text query matching any of words, each word is quoted as a phrase.
+        '''
+        ...
+
+    def make_json_filter(
+        self,
+        column: sa.Column,
+        path: str,
+        op: str,
+        value: t.Any,
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        '''
+        compare a path of json column with value by operator: eq, ne, gt, gte, lt, lte, in, nin, like, ilike, exists.
+        unlike make_filter, strings are compared exactly unless like/ilike is used.
+        '''
+        if op.lstrip("$") == "exists":
+            sample = None
+        elif isinstance(value, (list, tuple)):
+            sample = value[0] if value else None
+        else:
+            sample = value
+        return _compare(self._json_expr(column, path, sample), op, value)
+
+    @abc.abstractmethod
+    def _json_expr(self, column: sa.Column, path: str, value: t.Any = None) -> sa.ColumnElement:
+        '''
+        expression of a json path to compare with value, should be same as the metadata index expression.
+        '''
+        ...
+
     @abc.abstractmethod
     def make_filter(
         self,
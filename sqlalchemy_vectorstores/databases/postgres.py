@@ -6,9 +6,44 @@ import uuid
 import typing as t
 
 import sqlalchemy as sa
-from sqlalchemy_utils import ScalarListType
+from sqlalchemy.dialects.postgresql import ARRAY
 
-from .base import BaseDatabase
+from .base import BaseDatabase, _index_suffix, _is_like_pattern
+
+
+def _json_keys(path: str) -> t.List[str]:
+    return [x for x in path.split(".") if x and x != "$"]
+
+
+def _json_text(column: sa.Column, path: str) -> sa.ColumnElement:
+    '''
+    metadata ->> 'key' or metadata #>> '{a,b}' with the path rendered inline,
+    so an expression index on the same path can be used.
+    '''
+    keys = _json_keys(path)
+    if len(keys) == 1:
+        return column.op("->>", return_type=sa.Text)(sa.literal(keys[0], literal_execute=True))
+    return column.op("#>>", return_type=sa.Text)(sa.literal("{" + ",".join(keys) + "}", literal_execute=True))
+
+
+def _json_number(column: sa.Column, path: str) -> sa.ColumnElement:
+    return sa.cast(_json_text(column, path), sa.Float)
+
+
+def _json_nested(path: str, value: t.Any) -> dict:
+    '''
+    build {"a": {"b": value}} from path "a.b" to filter by jsonb @> operator.
+    '''
+    for key in reversed(_json_keys(path)):
+        value = {key: value}
+    return value
+
+
+def _any_ids(column: sa.Column, ids: t.List[str | int]) -> sa.ColumnElement:
+    '''
+    column = ANY(:ids), ids are bound as one array.
+    '''
+    return (column == sa.any_(sa.bindparam(None, ids, type_=ARRAY(column.type))))
 
 
 # latest psycopg fails on windows in default async loop
@@ -16,6 +51,13 @@ if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
+def _tsquery_or(words: t.Iterable[str]) -> str:
+    '''
+    to_tsquery text of any words, duplicated words are removed
+    '''
+    return " | ".join("'" + x.replace("'", "''") + "'" for x in dict.fromkeys(words) if x)
+
+
 class PostgresDatabase(BaseDatabase):
     '''
     use the postgres database to store documents, embeddings and tsvector
@@ -26,14 +68,18 @@ class PostgresDatabase(BaseDatabase):
         **db_kwds,
     ) -> None:
         super().__init__(db, **db_kwds)
-        self._init_database()
+        # the vector extension is created before the first vector table, no query is needed if tables exist
+        self._vector_ready = False
 
     def _init_database(self):
+        if self._vector_ready:
+            return
         with self.connect() as con:
             con.execute(sa.text("CREATE EXTENSION IF NOT EXISTS vector;"))
             con.commit()
+        self._vector_ready = True
 
-    def create_src_table(self, table_name: str) -> sa.Table:
+    def create_src_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document source
         '''
@@ -42,6 +88,8 @@ class PostgresDatabase(BaseDatabase):
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -52,10 +100,11 @@ class PostgresDatabase(BaseDatabase):
             sa.Column("tags", ScalarListType(), default=[]),
             sa.Column("metadata", JSONB, default={}),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
-    def create_doc_table(self, table_name: str) -> sa.Table:
+    def create_doc_table(self, table_name: str, emit_ddl: bool = True) -> sa.Table:
         '''
         table for document chunks
         '''
@@ -64,6 +113,8 @@ class PostgresDatabase(BaseDatabase):
         if table_name in self.tables:
             return self.tables[table_name]
 
+        from sqlalchemy_utils import ScalarListType
+
         table = sa.Table(
             table_name,
             self.metadata,
@@ -74,8 +125,13 @@ class PostgresDatabase(BaseDatabase):
             sa.Column("target_ids", ScalarListType(), default=[]),
             sa.Column("seq", sa.Integer),
             sa.Column("metadata", JSONB, default={}),
+            sa.Column("word_count", sa.Integer),
+            sa.Index(f"idx_{table_name}_src_id_seq", "src_id", "seq"),
+            sa.Index(f"idx_{table_name}_type", "type"),
+            sa.Index(f"idx_{table_name}_word_count", "word_count"),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
     def create_fts_table(
@@ -83,6 +139,7 @@ class PostgresDatabase(BaseDatabase):
         table_name: str,
         source_table: str,
         tokenize: str | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
         '''
         table for full text search in postgres.
@@ -97,9 +154,11 @@ class PostgresDatabase(BaseDatabase):
             self.metadata,
             sa.Column("id", sa.String(36)),
             sa.Column("tsv", TSVECTOR),
+            sa.Index(f"idx_{table_name}_id", "id"),
             sa.Index(f"idx_{table_name}_tsv", "tsv", postgresql_using="gin"),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            table.create(self.engine, checkfirst=True)
         return table
 
     def create_vec_table(
@@ -107,6 +166,7 @@ class PostgresDatabase(BaseDatabase):
         table_name: str,
         source_table: str,
         dim: int | None = None,
+        emit_ddl: bool = True,
     ) -> sa.Table:
 
         '''
@@ -122,10 +182,102 @@ class PostgresDatabase(BaseDatabase):
             self.metadata,
             sa.Column("doc_id", sa.String(36)),
             sa.Column("embedding", Vector(dim)),
+            sa.Index(f"idx_{table_name}_doc_id", "doc_id"),
         )
-        table.create(self.engine, checkfirst=True)
+        if emit_ddl:
+            self._init_database()
+            table.create(self.engine, checkfirst=True)
         return table
 
+    def create_metadata_index(
+        self,
+        table_name: str,
+        path: str = "",
+        type: t.Literal["text", "number", "gin"] = "text",
+    ) -> str:
+        '''
+        create an index for metadata filters:
+            text: expression index on metadata ->> path
+            number: expression index on (metadata ->> path)::float
+            gin: gin index with jsonb_path_ops on the whole metadata column, path is ignored.
+        '''
+        table = self.tables[table_name]
+        if type == "gin":
+            path = ""
+            name = f"idx_{table_name}_meta_gin"
+        elif type in ["text", "number"]:
+            path = ".".join(_json_keys(path))
+            name = f"idx_{table_name}_meta_{_index_suffix(path)}"
+            if type == "number":
+                name += "_num"
+        else:
+            raise RuntimeError(f"unsupported metadata index type for postgres: {type}")
+
+        index = next((x for x in table.indexes if x.name == name), None)
+        if index is None:
+            if type == "gin":
+                index = sa.Index(name, table.c.metadata, postgresql_using="gin",
+                                 postgresql_ops={"metadata": "jsonb_path_ops"})
+            elif type == "number":
+                index = sa.Index(name, _json_number(table.c.metadata, path))
+            else:
+                index = sa.Index(name, _json_text(table.c.metadata, path))
+        with self.connect() as con:
+            index.create(con, checkfirst=True)
+            con.commit()
+        self._metadata_indexes[(table_name, path)] = type
+        return name
+
+    def _json_expr(self, column: sa.Column, path: str, value: t.Any = None) -> sa.ColumnElement:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return _json_number(column, path)
+        else:
+            return _json_text(column, path)
+
+    def make_json_filter(
+        self,
+        column: sa.Column,
+        path: str,
+        op: str,
+        value: t.Any,
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        '''
+        same as BaseDatabase.make_json_filter, but use @> for equality if the column has a gin index
+        and the path has no expression index.
+        '''
+        path = ".".join(_json_keys(path))
+        if (op.lstrip("$") == "eq"
+            and value is not None
+            and self._metadata_index_type(column, path) is None
+            and self._metadata_index_type(column, "") == "gin"):
+            return (column.contains(_json_nested(path, value)))
+        # ->> returns booleans as text
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, (list, tuple)):
+            value = [str(x).lower() if isinstance(x, bool) else x for x in value]
+        return super().make_json_filter(column, path, op, value)
+
+    def lock_table(self, con: sa.Connection, table: sa.Table):
+        '''
+        row locks don't block inserts, SHARE ROW EXCLUSIVE conflicts with itself and other writers but not reads.
+        '''
+        name = con.dialect.identifier_preparer.format_table(table)
+        con.execute(sa.text(f"LOCK TABLE {name} IN SHARE ROW EXCLUSIVE MODE"))
+
+    def make_fts_query(self, words: t.Iterable[str]) -> str:
+        return _tsquery_or(words)
+
+    def make_ids_filter(
+        self,
+        column: sa.Column,
+        ids: t.Iterable[str | int],
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        ids = list(ids)
+        if len(ids) <= self.max_in_ids:
+            return super().make_ids_filter(column, ids)
+        return _any_ids(column, ids)
+
     def make_filter(
         self,
         column: sa.Column,
@@ -144,14 +296,31 @@ class PostgresDatabase(BaseDatabase):
                     text: sa.Column.ilike(value)
                     list_any: sa.or_(sa.Column.contains(x) for x in value)
                     list_all: sa.and_(sa.Column.contains(x) for x in value)
-                    dict: for metadata, sa.Column[json_key] [==, ilike] value
+                    dict: for metadata, sa.Column[json_key] [==, ilike] value.
+                        if the path is indexed by create_metadata_index, exact values are compared
+                        in the same form as the index expression, or by @> if the column has a gin index.
         Returns:
             sa.sql._typing.ColumnExpressionArgument
         """
         if type == "dict":
+            path = ".".join(_json_keys(json_key))
+            index_type = self._metadata_index_type(column, path)
+            use_gin = index_type is None and self._metadata_index_type(column, "") == "gin"
             if isinstance(value, str):
-                return (column[json_key].as_string().ilike(value))
+                if _is_like_pattern(value):
+                    return (_json_text(column, path).ilike(value))
+                elif index_type == "text":
+                    return (_json_text(column, path) == value)
+                elif use_gin:
+                    return (column.contains(_json_nested(path, value)))
+                else:
+                    return (_json_text(column, path).ilike(value))
             else:
-                return (column[json_key] == value)
+                if index_type == "number" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    return (_json_number(column, path) == value)
+                elif use_gin:
+                    return (column.contains(_json_nested(path, value)))
+                else:
+                    return (column[json_key] == value)
         else:
             return super().make_filter(column, value, type)
@@ -8,8 +8,10 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy import event as sa_event
 
 from sqlalchemy_vectorstores.tokenizers.base import BaseTokenize
+from .base import _index_suffix, _is_like_pattern
 from .base_async import AsyncBaseDatabase
 from .sa_types import SqliteVector, DATA_PATH
+from .sqlite import _json_path, _json_extract, _json_each_ids, _pretokenized_fts_sql, _fts_or_query
 
 if t.TYPE_CHECKING:
     import sqlite3
@@ -59,77 +61,95 @@ class AsyncSqliteDatabase(AsyncBaseDatabase):
             con.load_extension(str(DATA_PATH / "simple" / "simple"))
             con.enable_load_extension(False)
 
-    async def create_fts_table(self, table_name: str, source_table: str, tokenize: str = "porter") -> sa.Table:
+    def _index_names(self, con: sa.Connection, table_name: str) -> t.Set[str]:
+        # sqlalchemy skips reflection of expression indexes in sqlite
+        stmt = sa.text("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=:table")
+        return {x[0] for x in con.execute(stmt, {"table": table_name})}
+
+    async def create_fts_table(
+        self,
+        table_name: str,
+        source_table: str,
+        tokenize: str | BaseTokenize = "porter",
+        emit_ddl: bool = True,
+    ) -> sa.Table:
         '''
-        table for full text search in sqlite
+        table for full text search in sqlite.
+        if tokenize is a tokenizer, content is pretokenized by the store and indexed by the builtin unicode61 tokenizer.
         '''
         if table_name in self.tables:
             return self.tables[table_name]
 
         columns = ["id", "content"]
-        async with self.connect() as con:
-            create_fts_sql = (
-                textwrap.dedent(
-                    """
-                CREATE VIRTUAL TABLE IF NOT EXISTS [{fts_table_name}]
-                    USING fts5 (
-                    {columns},{tokenize}
-                    content=[{table}]
-                )
-            """
-                )
-                .strip()
-                .format(
-                    table=source_table,
-                    fts_table_name=table_name,
-                    columns=", ".join("[{}]".format(c) for c in columns),
-                    tokenize="\n    tokenize='{}',".format(tokenize) if tokenize else "",
-                )
-            )
-            await con.execute(sa.text(create_fts_sql))
-
-            # create triggers
-            old_cols = ", ".join("old.[{}]".format(c) for c in columns)
-            new_cols = ", ".join("new.[{}]".format(c) for c in columns)
-            triggers = (
-                textwrap.dedent(
-                    """
-                CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_ai] AFTER INSERT ON [{table}] BEGIN
-                  INSERT INTO [{fts_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
-                END;
-                CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_ad] AFTER DELETE ON [{table}] BEGIN
-                  INSERT INTO [{fts_table_name}] ([{fts_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
-                END;
-                CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_au] AFTER UPDATE ON [{table}] BEGIN
-                  INSERT INTO [{fts_table_name}] ([{fts_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
-                  INSERT INTO [{fts_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
-                END;
-            """
+        if emit_ddl and isinstance(tokenize, BaseTokenize):
+            # content is tokenized in python and written by the store, no triggers
+            async with self.connect() as con:
+                await con.execute(sa.text(_pretokenized_fts_sql(table_name)))
+        elif emit_ddl:
+            async with self.connect() as con:
+                create_fts_sql = (
+                    textwrap.dedent(
+                        """
+                    CREATE VIRTUAL TABLE IF NOT EXISTS [{fts_table_name}]
+                        USING fts5 (
+                        {columns},{tokenize}
+                        content=[{table}]
+                    )
+                """
+                    )
+                    .strip()
+                    .format(
+                        table=source_table,
+                        fts_table_name=table_name,
+                        columns=", ".join("[{}]".format(c) for c in columns),
+                        tokenize="\n    tokenize='{}',".format(tokenize) if tokenize else "",
+                    )
                 )
-                .strip()
-                .format(
-                    table=source_table,
-                    fts_table_name=table_name,
-                    columns=", ".join("[{}]".format(c) for c in columns),
-                    old_cols=old_cols,
-                    new_cols=new_cols,
+                await con.execute(sa.text(create_fts_sql))
+
+                # create triggers
+                old_cols = ", ".join("old.[{}]".format(c) for c in columns)
+                new_cols = ", ".join("new.[{}]".format(c) for c in columns)
+                triggers = (
+                    textwrap.dedent(
+                        """
+                    CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_ai] AFTER INSERT ON [{table}] BEGIN
+                      INSERT INTO [{fts_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_ad] AFTER DELETE ON [{table}] BEGIN
+                      INSERT INTO [{fts_table_name}] ([{fts_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS [{fts_table_name}_au] AFTER UPDATE ON [{table}] BEGIN
+                      INSERT INTO [{fts_table_name}] ([{fts_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
+                      INSERT INTO [{fts_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
+                    END;
+                """
+                    )
+                    .strip()
+                    .format(
+                        table=source_table,
+                        fts_table_name=table_name,
+                        columns=", ".join("[{}]".format(c) for c in columns),
+                        old_cols=old_cols,
+                        new_cols=new_cols,
+                    )
                 )
-            )
-            # con._dbapi_connection.executescript(triggers)
-            for trigger in [x for x in triggers.split("END;") if x.strip()]:
-                await con.execute(sa.text(trigger + "END;"))
-
-            # self.metadata.reflect(self.engine, only=[table_name])
-            table = sa.Table(
-                table_name,
-                self.metadata,
-                sa.Column("id", sa.String(36)),
-                sa.Column("content", sa.Text),
-                sa.Column("rank", sa.Float),
-            )
-            return table
-
-    async def create_vec_table(self, table_name: str, source_table: str, dim: int) -> sa.Table:
+                # con._dbapi_connection.executescript(triggers)
+                for trigger in [x for x in triggers.split("END;") if x.strip()]:
+                    await con.execute(sa.text(trigger + "END;"))
+
+        # self.metadata.reflect(self.engine, only=[table_name])
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("id", sa.String(36)),
+            sa.Column("content", sa.Text),
+            sa.Column("rank", sa.Float),
+            sa.Column("rowid", sa.Integer),
+        )
+        return table
+
+    async def create_vec_table(self, table_name: str, source_table: str, dim: int, emit_ddl: bool = True) -> sa.Table:
         '''
         table for vector search in sqlite using sqlite-vec
         '''
@@ -137,63 +157,106 @@ class AsyncSqliteDatabase(AsyncBaseDatabase):
             return self.tables[table_name]
 
         columns = ["embedding"]
+        if emit_ddl:
+            async with self.connect() as con:
+                create_vec_sql = (textwrap.dedent(
+                    """
+                        CREATE VIRTUAL TABLE IF NOT EXISTS [{vec_table_name}]
+                        USING vec0(
+                        doc_id TEXT PRIMARY KEY,
+                        embedding FLOAT[{dim}]
+                        );
+                    """
+                )
+                .strip()
+                .format(
+                    vec_table_name=table_name,
+                    dim=dim,
+                ))
+                await con.execute(sa.text(create_vec_sql))
+
+                # # create triggers
+                # old_cols = ", ".join("old.[{}]".format(c) for c in columns)
+                # new_cols = ", ".join("new.[{}]".format(c) for c in columns)
+                # triggers = (
+                #     textwrap.dedent(
+                #         """
+                #     CREATE TRIGGER IF NOT EXISTS [{table}_ai] AFTER INSERT ON [{table}] BEGIN
+                #       INSERT INTO [{vec_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
+                #     END;
+                #     CREATE TRIGGER IF NOT EXISTS [{table}_ad] AFTER DELETE ON [{table}] BEGIN
+                #       INSERT INTO [{vec_table_name}] ([{vec_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
+                #     END;
+                #     CREATE TRIGGER IF NOT EXISTS [{table}_au] AFTER UPDATE ON [{table}] BEGIN
+                #       INSERT INTO [{vec_table_name}] ([{vec_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
+                #       INSERT INTO [{vec_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
+                #     END;
+                # """
+                #     )
+                #     .strip()
+                #     .format(
+                #         table=table_name,
+                #         vec_table_name=table_name,
+                #         columns=", ".join("[{}]".format(c) for c in columns),
+                #         old_cols=old_cols,
+                #         new_cols=new_cols,
+                #     )
+                # )
+                # con._dbapi_connection.executescript(triggers)
+                # for trigger in [x for x in triggers.split("END;") if x.strip()]:
+                #     await con.execute(sa.text(trigger + "END;"))
+
+        # self.metadata.reflect(self.engine, only=[table_name])
+        table = sa.Table(
+            table_name,
+            self.metadata,
+            sa.Column("doc_id", sa.String(36)),
+            sa.Column("embedding", SqliteVector(dim=dim)),
+            sa.Column("distance", sa.Float),
+        )
+        return table
+
+    async def create_metadata_index(
+        self,
+        table_name: str,
+        path: str = "",
+        type: t.Literal["text", "number"] = "text",
+    ) -> str:
+        '''
+        create an expression index on json_extract(metadata, path).
+        sqlite stores json values with their own types, so text and number paths use the same index.
+        '''
+        if type not in ["text", "number"]:
+            raise RuntimeError(f"unsupported metadata index type for sqlite: {type}")
+
+        table = self.tables[table_name]
+        json_path = _json_path(path)
+        name = f"idx_{table_name}_meta_{_index_suffix(json_path)}"
+        index = next((x for x in table.indexes if x.name == name), None)
+        if index is None:
+            index = sa.Index(name, _json_extract(table.c.metadata, json_path))
         async with self.connect() as con:
-            create_vec_sql = (textwrap.dedent(
-                """
-                    CREATE VIRTUAL TABLE IF NOT EXISTS [{vec_table_name}]
-                    USING vec0(
-                    doc_id TEXT PRIMARY KEY,
-                    embedding FLOAT[{dim}]
-                    );
-                """
-            )
-            .strip()
-            .format(
-                vec_table_name=table_name,
-                dim=dim,
-            ))
-            await con.execute(sa.text(create_vec_sql))
-
-            # # create triggers
-            # old_cols = ", ".join("old.[{}]".format(c) for c in columns)
-            # new_cols = ", ".join("new.[{}]".format(c) for c in columns)
-            # triggers = (
-            #     textwrap.dedent(
-            #         """
-            #     CREATE TRIGGER IF NOT EXISTS [{table}_ai] AFTER INSERT ON [{table}] BEGIN
-            #       INSERT INTO [{vec_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
-            #     END;
-            #     CREATE TRIGGER IF NOT EXISTS [{table}_ad] AFTER DELETE ON [{table}] BEGIN
-            #       INSERT INTO [{vec_table_name}] ([{vec_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
-            #     END;
-            #     CREATE TRIGGER IF NOT EXISTS [{table}_au] AFTER UPDATE ON [{table}] BEGIN
-            #       INSERT INTO [{vec_table_name}] ([{vec_table_name}], rowid, {columns}) VALUES('delete', old.rowid, {old_cols});
-            #       INSERT INTO [{vec_table_name}] (rowid, {columns}) VALUES (new.rowid, {new_cols});
-            #     END;
-            # """
-            #     )
-            #     .strip()
-            #     .format(
-            #         table=table_name,
-            #         vec_table_name=table_name,
-            #         columns=", ".join("[{}]".format(c) for c in columns),
-            #         old_cols=old_cols,
-            #         new_cols=new_cols,
-            #     )
-            # )
-            # con._dbapi_connection.executescript(triggers)
-            # for trigger in [x for x in triggers.split("END;") if x.strip()]:
-            #     await con.execute(sa.text(trigger + "END;"))
-
-            # self.metadata.reflect(self.engine, only=[table_name])
-            table = sa.Table(
-                table_name,
-                self.metadata,
-                sa.Column("doc_id", sa.String(36)),
-                sa.Column("embedding", SqliteVector(dim)),
-                sa.Column("distance", sa.Float),
-            )
-            return table
+            if name not in (await con.run_sync(self._index_names, table_name)):
+                await con.run_sync(index.create)
+                await con.commit()
+        self._metadata_indexes[(table_name, json_path)] = type
+        return name
+
+    def _json_expr(self, column: sa.Column, path: str, value: t.Any = None) -> sa.ColumnElement:
+        return _json_extract(column, _json_path(path))
+
+    def make_fts_query(self, words: t.Iterable[str]) -> str:
+        return _fts_or_query(words)
+
+    def make_ids_filter(
+        self,
+        column: sa.Column,
+        ids: t.Iterable[str | int],
+    ) -> sa.sql._typing.ColumnExpressionArgument:
+        ids = list(ids)
+        if len(ids) <= self.max_in_ids:
+            return super().make_ids_filter(column, ids)
+        return _json_each_ids(column, ids)
 
     def make_filter(
         self,
@@ -213,16 +276,21 @@ class AsyncSqliteDatabase(AsyncBaseDatabase):
                     text: sa.Column.ilike(value)
                     list_any: sa.or_(sa.Column.contains(x) for x in value)
                     list_all: sa.and_(sa.Column.contains(x) for x in value)
-                    dict: for metadata, "json_extract(sa.Column, json_path) [==, ilike] value
+                    dict: for metadata, "json_extract(sa.Column, json_path) [==, ilike] value.
+                        string values are compared by ilike, unless the path is indexed by create_metadata_index
+                        and the value has no "%" wildcard, then == is used to hit the index.
         Returns:
             sa.sql._typing.ColumnExpressionArgument
         """
         if type == "dict":
-            if not json_path.startswith("$."):
-                json_path = "$." + json_path
+            json_path = _json_path(json_path)
+            expr = _json_extract(column, json_path)
             if isinstance(value, str):
-                return (sa.func.json_extract(column, json_path).ilike(value))
+                if (self._metadata_index_type(column, json_path) is not None
+                    and not _is_like_pattern(value)):
+                    return (expr == value)
+                return (expr.ilike(value))
             else:
-                return (sa.func.json_extract(column, json_path) == value)
+                return (expr == value)
         else:
             return super().make_filter(column, value, type)
@@ -161,6 +161,7 @@ def create_postgres_store_zh(
     clear_existed: bool = False,
     is_async: T.Literal[False] = False,
     echo: bool = False,
+    tokenize_processes: int | None = 0,
 ) -> tuple[PostgresDatabase, PostgresVectorStore]:
     ...
 
@@ -175,6 +176,7 @@ def create_postgres_store_zh(
     clear_existed: bool = False,
     is_async: T.Literal[True] = True,
     echo: bool = False,
+    tokenize_processes: int | None = 0,
 ) -> tuple[AsyncPostgresDatabase, AsyncPostgresVectorStore]:
     ...
 
@@ -188,6 +190,7 @@ def create_postgres_store_zh(
     clear_existed: bool = False,
     is_async: bool = False,
     echo: bool = False,
+    tokenize_processes: int | None = 0,
 ) -> tuple[PostgresDatabase | AsyncPostgresDatabase, PostgresVectorStore | AsyncPostgresVectorStore]:
     if is_async:
         db_cls = AsyncPostgresDatabase
@@ -203,7 +206,7 @@ def create_postgres_store_zh(
         embedding_func=embedding_func,
         dim=dim,
         clear_existed=clear_existed,
-        fts_tokenize=JiebaTokenize().as_pg_tokenize(),
+        fts_tokenize=JiebaTokenize(processes=tokenize_processes).as_pg_tokenize(),
     )
     return db, vs
 
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import typing as t
+
+from sqlalchemy_vectorstores._lazy import lazy_attrs
+
+if t.TYPE_CHECKING:
+    from .base import BaseRetriever, AsyncBaseRetriever
+
+
+_LAZY_IMPORTS = {
+    "BaseRetriever": ".base",
+    "AsyncBaseRetriever": ".base",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+__getattr__, __dir__ = lazy_attrs(__name__, _LAZY_IMPORTS)
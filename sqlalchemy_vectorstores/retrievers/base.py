@@ -1,19 +1,165 @@
 from __future__ import annotations
 
 import abc
+import asyncio
+import concurrent.futures
+import threading
 import typing as t
 
+import sqlalchemy as sa
+
 from sqlalchemy_vectorstores import BaseVectorStore, DocType
+from sqlalchemy_vectorstores.vectorstores import AsyncBaseVectorStore
+from sqlalchemy_vectorstores.tokenizers.base import BaseTokenize
 from sqlalchemy_vectorstores.tokenizers.jieba_tokenize import JiebaTokenize
 
 
+# threads embedding queries of all retrievers, created on first use
+_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="retriever")
+        return _executor
+
+
+def _retrieve_filters(
+    src_id: str | None = None,
+    src_url: str | None = None,
+    src_metadata: t.Dict | None = None,
+    src_tags_all: t.List[str] | None = None,
+    src_tags_any: t.List[str] | None = None,
+    doc_metadata: t.Dict | None = None,
+    doc_types: t.List[DocType] | None = None,
+) -> t.Dict:
+    '''
+    declarative filters of retrieve arguments, metadata values can be plain values or operator dicts
+    '''
+    filters = {}
+    if src_id is not None:
+        filters["src_id"] = src_id
+    if src_url is not None:
+        filters["src.src"] = src_url
+    for k, v in (src_metadata or {}).items():
+        filters[f"src.metadata.{k}"] = v
+    tags = {}
+    if src_tags_all:
+        tags["$all"] = list(src_tags_all)
+    if src_tags_any:
+        tags["$in"] = list(src_tags_any)
+    if tags:
+        filters["tags"] = tags
+    for k, v in (doc_metadata or {}).items():
+        filters[f"doc.metadata.{k}"] = v
+    if doc_types:
+        filters["type"] = {"$in": [getattr(x, "value", x) for x in doc_types]}
+    return filters
+
+
+def _fuse_channels(channels: t.List[t.List[t.Dict]], rrf_k: int = 60) -> t.List[t.Dict]:
+    '''
+    deduplicate documents of channels by id and order them by reciprocal rank fusion.
+    score is the negative fused score, scores of channels are kept in `scores`.
+    '''
+    docs = {}
+    for name, channel in zip(["vector", "bm25"], channels):
+        for rank, doc in enumerate(channel, 1):
+            if (x := docs.get(doc["id"])) is None:
+                x = docs[doc["id"]] = {**doc, "score": 0, "scores": {}}
+            x["score"] -= 1 / (rrf_k + rank)
+            x["scores"][name] = doc["score"]
+    return sorted(docs.values(), key=lambda x: x["score"])
+
+
+def _pack_docs(
+    docs: t.List[t.Dict],
+    count_words: t.Callable[[str], int],
+    top_k: int | None = None,
+    max_words: int | None = None,
+    min_words: int | None = None,
+) -> t.List[t.Dict]:
+    '''
+    take documents in order until top_k, documents exceeding max_words in total are skipped.
+    more than top_k documents are taken while there are less than min_words.
+    stored `word_count` of documents is used, count_words counts documents without it.
+    '''
+    result = []
+    total = 0
+    for doc in docs:
+        if top_k is not None and len(result) >= top_k and (min_words is None or total >= min_words):
+            break
+        words = doc.get("word_count")
+        if words is None:
+            words = count_words(doc["content"])
+        if max_words is not None and total + words > max_words:
+            continue
+        total += words
+        result.append(doc)
+    return result
+
+
+def _materialize(fused: t.List[t.Dict], docs: t.List[t.Dict]) -> t.List[t.Dict]:
+    '''
+    merge fetched documents with fused scores, in order of fused
+    '''
+    docs = {x["id"]: x for x in docs}
+    return [{**docs[x["id"]], "score": x["score"], "scores": x["scores"]} for x in fused if x["id"] in docs]
+
+
+def _survivors(
+    fused: t.List[t.Dict],
+    count_words: t.Callable[[str], int],
+    top_k: int | None = None,
+    max_words: int | None = None,
+    min_words: int | None = None,
+) -> t.List[t.Dict]:
+    '''
+    candidates to fetch. they are packed by stored `word_count` already,
+    unless some documents (of older stores) have no word_count, then all of them are needed to pack by content.
+    '''
+    if all(x.get("word_count") is not None for x in fused):
+        return _pack_docs(fused, count_words, top_k=top_k, max_words=max_words, min_words=min_words)
+    if top_k is not None and max_words is None and min_words is None:
+        return fused[:top_k]
+    return fused
+
+
 class BaseRetriever(abc.ABC):
-    def __init__(self, vs: BaseVectorStore) -> None:
+    def __init__(self, vs: BaseVectorStore, tokenize: BaseTokenize | None = None) -> None:
         self.vs = vs
-        self.tokenize = JiebaTokenize()
+        self.tokenize = tokenize or JiebaTokenize()
 
     def count_words(self, text: str) -> int:
-        return len(self.tokenize.cut_words(text))
+        return len(list(self.tokenize.cut_words(text)))
+
+    def make_bm25_query(self, query: str) -> str:
+        '''
+        full text query matching any words of query
+        '''
+        return self.vs.db.make_fts_query(self.tokenize.lcut_words(query))
+
+    def make_filters(self, max_words: int | None = None, **kwargs) -> t.List[sa.sql._typing.ColumnExpressionArgument]:
+        '''
+        compile filters of retrieve arguments once for all channels, documents longer than max_words are excluded.
+        '''
+        filters = self.vs.make_filters(_retrieve_filters(**kwargs))
+        if max_words is not None:
+            c = self.vs.doc_table.c.word_count
+            filters.append(sa.or_(c.is_(None), c <= max_words))
+        return filters
+
+    def pack(
+        self,
+        docs: t.List[t.Dict],
+        top_k: int | None = None,
+        max_words: int | None = None,
+        min_words: int | None = None,
+    ) -> t.List[t.Dict]:
+        return _pack_docs(docs, self.count_words, top_k=top_k, max_words=max_words, min_words=min_words)
 
     def retrieve(
         self,
@@ -34,25 +180,141 @@ class BaseRetriever(abc.ABC):
         doc_types: t.List[DocType] | None = None,
     ) -> t.List[t.Dict]:
         """
-        retrieve documents from vectorstore
+        retrieve documents from vectorstore by vector and bm25, filters are compiled once and pushed into sql.
+        the query is embedded while searching by bm25, documents of both channels are deduplicated by id,
+        ordered by reciprocal rank fusion and packed to the words budget.
 
         Args:
             query (str): user query string
             query_bm25 (str | None, optional): custom bm25 query string instead of using default words cut. Defaults to None.
-            top_k (int | None, optional): _description_. Defaults to None.
-            fetch_k (int | None, optional): _description_. Defaults to None.
-            max_words (int | None, optional): _description_. Defaults to None.
-            min_words (int | None, optional): _description_. Defaults to None.
-            score_threshold_vector (float | None, optional): _description_. Defaults to None.
-            score_threshold_bm25 (float | None, optional): _description_. Defaults to -0.1.
-            src_id (str | None, optional): _description_. Defaults to None.
-            src_url (str | None, optional): _description_. Defaults to None.
-            src_metadata (t.Dict | None, optional): _description_. Defaults to None.
-            src_tags_all (t.List[str] | None, optional): _description_. Defaults to None.
-            src_tags_any (t.List[str] | None, optional): _description_. Defaults to None.
-            doc_metadata (t.Dict | None, optional): _description_. Defaults to None.
-            doc_types (t.List[str] | None, optional): _description_. Defaults to None.
+            top_k (int | None, optional): max number of documents, unlimited if None. Defaults to None.
+            fetch_k (int | None, optional): number of candidates of each channel. Defaults to 4 * top_k.
+            max_words (int | None, optional): max words of all documents. Defaults to None.
+            min_words (int | None, optional): take more than top_k documents until min words. Defaults to None.
+            score_threshold_vector (float | None, optional): max score of vector search. Defaults to None.
+            score_threshold_bm25 (float | None, optional): max score of bm25 search. Defaults to -0.1.
+            src_id (str | None, optional): id of source. Defaults to None.
+            src_url (str | None, optional): url of source. Defaults to None.
+            src_metadata (t.Dict | None, optional): metadata paths and values of source. Defaults to None.
+            src_tags_all (t.List[str] | None, optional): source has all the tags. Defaults to None.
+            src_tags_any (t.List[str] | None, optional): source has any of the tags. Defaults to None.
+            doc_metadata (t.Dict | None, optional): metadata paths and values of document. Defaults to None.
+            doc_types (t.List[str] | None, optional): types of document. Defaults to None.
 
         Returns:
-            t.List[t.Dict]: a list of documents
-        """
\ No newline at end of file
+            t.List[t.Dict]: a list of documents, with fused `score` and `scores` of channels
+        """
+        filters = self.make_filters(max_words=max_words, src_id=src_id, src_url=src_url, src_metadata=src_metadata,
+                                    src_tags_all=src_tags_all, src_tags_any=src_tags_any,
+                                    doc_metadata=doc_metadata, doc_types=doc_types)
+        fetch_k = fetch_k or (top_k or 3) * 4
+        query_bm25 = query_bm25 or self.make_bm25_query(query)
+        # embed query in background while searching by bm25,
+        # connections of sqlite memory databases are bound to threads, so queries run in this thread.
+        embedding = _get_executor().submit(self.vs.embedding_func, query)
+        # channels return ids, scores and word counts, documents are fetched for packed candidates only
+        docs_bm25 = []
+        if query_bm25:
+            docs_bm25 = self.vs.search_by_bm25(query_bm25, top_k=fetch_k, score_threshold=score_threshold_bm25,
+                                               filters=filters, columns=["word_count"])
+        docs_vector = self.vs.search_by_vector(embedding.result(), top_k=fetch_k, score_threshold=score_threshold_vector,
+                                               filters=filters, columns=["word_count"])
+        fused = _survivors(_fuse_channels([docs_vector, docs_bm25]), self.count_words,
+                           top_k=top_k, max_words=max_words, min_words=min_words)
+        docs = _materialize(fused, self.vs.fetch_documents([x["id"] for x in fused]))
+        return self.pack(docs, top_k=top_k, max_words=max_words, min_words=min_words)
+
+
+class AsyncBaseRetriever(abc.ABC):
+    def __init__(self, vs: AsyncBaseVectorStore, tokenize: BaseTokenize | None = None) -> None:
+        self.vs = vs
+        self.tokenize = tokenize or JiebaTokenize()
+
+    def count_words(self, text: str) -> int:
+        return len(list(self.tokenize.cut_words(text)))
+
+    def make_bm25_query(self, query: str) -> str:
+        '''
+        full text query matching any words of query
+        '''
+        return self.vs.db.make_fts_query(self.tokenize.lcut_words(query))
+
+    def make_filters(self, max_words: int | None = None, **kwargs) -> t.List[sa.sql._typing.ColumnExpressionArgument]:
+        '''
+        compile filters of retrieve arguments once for all channels, documents longer than max_words are excluded.
+        '''
+        filters = self.vs.make_filters(_retrieve_filters(**kwargs))
+        if max_words is not None:
+            c = self.vs.doc_table.c.word_count
+            filters.append(sa.or_(c.is_(None), c <= max_words))
+        return filters
+
+    def pack(
+        self,
+        docs: t.List[t.Dict],
+        top_k: int | None = None,
+        max_words: int | None = None,
+        min_words: int | None = None,
+    ) -> t.List[t.Dict]:
+        return _pack_docs(docs, self.count_words, top_k=top_k, max_words=max_words, min_words=min_words)
+
+    async def retrieve(
+        self,
+        query: str,
+        query_bm25: str | None = None,
+        top_k: int | None = None,
+        fetch_k: int | None = None,
+        max_words: int | None = None,
+        min_words: int | None = None,
+        score_threshold_vector: float | None = None,
+        score_threshold_bm25: float | None = -0.1,
+        src_id: str | None = None,
+        src_url: str | None = None,
+        src_metadata: t.Dict | None = None,
+        src_tags_all: t.List[str] | None = None,
+        src_tags_any: t.List[str] | None = None,
+        doc_metadata: t.Dict | None = None,
+        doc_types: t.List[DocType] | None = None,
+    ) -> t.List[t.Dict]:
+        """
+        retrieve documents from vectorstore by vector and bm25, filters are compiled once and pushed into sql.
+        vector and bm25 channels run concurrently, documents of both channels are deduplicated by id,
+        ordered by reciprocal rank fusion and packed to the words budget.
+
+        Args:
+            query (str): user query string
+            query_bm25 (str | None, optional): custom bm25 query string instead of using default words cut. Defaults to None.
+            top_k (int | None, optional): max number of documents, unlimited if None. Defaults to None.
+            fetch_k (int | None, optional): number of candidates of each channel. Defaults to 4 * top_k.
+            max_words (int | None, optional): max words of all documents. Defaults to None.
+            min_words (int | None, optional): take more than top_k documents until min words. Defaults to None.
+            score_threshold_vector (float | None, optional): max score of vector search. Defaults to None.
+            score_threshold_bm25 (float | None, optional): max score of bm25 search. Defaults to -0.1.
+            src_id (str | None, optional): id of source. Defaults to None.
+            src_url (str | None, optional): url of source. Defaults to None.
+            src_metadata (t.Dict | None, optional): metadata paths and values of source. Defaults to None.
+            src_tags_all (t.List[str] | None, optional): source has all the tags. Defaults to None.
+            src_tags_any (t.List[str] | None, optional): source has any of the tags. Defaults to None.
+            doc_metadata (t.Dict | None, optional): metadata paths and values of document. Defaults to None.
+            doc_types (t.List[str] | None, optional): types of document. Defaults to None.
+
+        Returns:
+            t.List[t.Dict]: a list of documents, with fused `score` and `scores` of channels
+        """
+        # filters read tables of the store, which may be initialized lazily
+        await self.vs._ensure_init()
+        filters = self.make_filters(max_words=max_words, src_id=src_id, src_url=src_url, src_metadata=src_metadata,
+                                    src_tags_all=src_tags_all, src_tags_any=src_tags_any,
+                                    doc_metadata=doc_metadata, doc_types=doc_types)
+        fetch_k = fetch_k or (top_k or 3) * 4
+        query_bm25 = query_bm25 or self.make_bm25_query(query)
+        # channels return ids, scores and word counts, documents are fetched for packed candidates only
+        channels = [self.vs.search_by_vector(query, top_k=fetch_k, score_threshold=score_threshold_vector,
+                                             filters=filters, columns=["word_count"])]
+        if query_bm25:
+            channels.append(self.vs.search_by_bm25(query_bm25, top_k=fetch_k, score_threshold=score_threshold_bm25,
+                                                   filters=filters, columns=["word_count"]))
+        fused = _fuse_channels(list(await asyncio.gather(*channels)))
+        fused = _survivors(fused, self.count_words, top_k=top_k, max_words=max_words, min_words=min_words)
+        docs = _materialize(fused, await self.vs.fetch_documents([x["id"] for x in fused]))
+        return self.pack(docs, top_k=top_k, max_words=max_words, min_words=min_words)
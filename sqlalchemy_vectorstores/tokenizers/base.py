@@ -1,18 +1,181 @@
 from __future__ import annotations
 
 import abc
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import os
+import threading
 import typing as t
 
 
+# tokenizer of a worker process, set by pool initializer
+_worker_tokenize: BaseTokenize | None = None
+
+
+def _init_worker(tokenize: BaseTokenize):
+    global _worker_tokenize
+    tokenize.initialize()
+    _worker_tokenize = tokenize
+
+
+def _worker_call(method: str, texts: t.List[str]) -> t.List[str]:
+    func = getattr(_worker_tokenize, method)
+    return [func(x) for x in texts]
+
+
+def _parse_word(w: str | t.Tuple | t.List | t.Dict) -> t.Tuple[str | None, int | None, str | None]:
+    '''
+    parse an item of user dict to (word, freq, tag), item can be: word, (word, freq, tag) or {"word", "freq", "tag"}
+    '''
+    word = None
+    freq = None
+    tag = None
+
+    if isinstance(w, str):
+        word = w
+    elif isinstance(w, (tuple, list)):
+        if len(w) >= 1:
+            word = w[0]
+        if len(w) >= 2:
+            freq = w[1]
+        if len(w) >= 3:
+            tag = w[2]
+    elif isinstance(w, dict):
+        word = w.get("word")
+        freq = w.get("freq")
+        tag = w.get("tag")
+    return word, freq, tag
+
+
 class BaseTokenize(abc.ABC):
     '''
     An unit class to cut text to fts tokens for sqlite & postgres
+
+    `batch_to_tsvector` and `batch_to_fts_text` tokenize batches of at least `min_batch_size` texts in a pool of `processes` workers,
+    processes=0 means tokenizing in the calling thread, None means the number of CPUs.
+
+    words of texts not longer than `cache_max_len` (queries) are cached in a LRU cache of `cache_size`,
+    use `set_stop_words`/`add_user_words` to change them, which clear the cache.
+
+    `words_version` is the version of words table the tokenizer synced to, see `BaseVectorStore.sync_tokenizer`.
     '''
-    def __init__(self, stop_words: t.List[str]=[], user_dict: t.List[t.Dict]=[]) -> None:
+    def __init__(
+        self,
+        stop_words: t.List[str]=[],
+        user_dict: t.List[t.Dict]=[],
+        processes: int | None = 0,
+        min_batch_size: int = 64,
+        cache_size: int = 1024,
+        cache_max_len: int = 100,
+    ) -> None:
         self._sqlite_tokenize = None
-        self._pg_tokenize = None
         self._stop_words = stop_words
         self._user_dict = user_dict
+        self.processes = processes
+        self.min_batch_size = min_batch_size
+        self.cache_size = cache_size
+        self.cache_max_len = cache_max_len
+        self.words_version = 0
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_lock = threading.Lock()
+        self._init_cache()
+
+    def _init_cache(self):
+        self._cache: OrderedDict[t.Tuple, t.Tuple[str, ...]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def __getstate__(self) -> t.Dict:
+        # sent to worker processes without unpicklable members
+        state = self.__dict__.copy()
+        state.update(_sqlite_tokenize=None, _pool=None, _pool_lock=None, _cache=None, _cache_lock=None)
+        return state
+
+    def __setstate__(self, state: t.Dict):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+        self._init_cache()
+
+    def _cache_options(self) -> t.Tuple:
+        '''
+        options of the tokenizer that change results, they are part of cache keys.
+        '''
+        return ()
+
+    def _cached(self, method: str, text: str, func: t.Callable[[str], t.List[str]]) -> t.List[str]:
+        if self.cache_size <= 0 or len(text) > self.cache_max_len:
+            return func(text)
+
+        key = (method, text, self._cache_options())
+        with self._cache_lock:
+            if (res := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+                return list(res)
+            self._cache_misses += 1
+
+        res = tuple(func(text))
+        with self._cache_lock:
+            self._cache[key] = res
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(res)
+
+    def cache_stats(self) -> t.Dict[str, int | float]:
+        '''
+        hits, misses, hit_rate and size of the words cache
+        '''
+        with self._cache_lock:
+            total = self._cache_hits + self._cache_misses
+            return {
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "hit_rate": self._cache_hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_hits = 0
+            self._cache_misses = 0
+
+    def set_stop_words(self, stop_words: t.List[str]):
+        self._stop_words = list(stop_words)
+        self.clear_cache()
+        self.close()
+
+    def add_user_words(self, user_dict: t.List[t.Dict]):
+        self._user_dict = [*self._user_dict, *user_dict]
+        self.clear_cache()
+        self.close()
+
+    def _merge_words(self, rows: t.List[t.Dict]) -> t.List[str]:
+        words = {x["word"] for x in rows}
+        self._stop_words = ([x for x in self._stop_words if x not in words]
+                            + [x["word"] for x in rows if x["status"] == 0])
+        self._user_dict = ([x for x in self._user_dict if _parse_word(x)[0] not in words]
+                           + [{"word": x["word"], "freq": x["freq"], "tag": x["tag"]} for x in rows if x["status"] == 1])
+        # worker processes are restarted with new words
+        self.close()
+        return sorted(words)
+
+    def apply_words(self, rows: t.List[t.Dict]) -> t.List[str]:
+        '''
+        apply changed rows of words table ({"word", "freq", "tag", "status"}):
+        status 0 makes a stop word, 1 makes a user dict word, others remove the word.
+        return the changed words.
+        '''
+        words = self._merge_words(rows)
+        self.clear_cache()
+        return words
+
+    def initialize(self):
+        '''
+        load dictionaries before tokenizing, it's called once in every worker process.
+        '''
 
     def load_stop_words(self) -> t.List[str]:
         return self._stop_words
@@ -28,7 +191,7 @@ class BaseTokenize(abc.ABC):
         ...
 
     def lcut_words(self, text: str) -> list[str]:
-        return [x[0] for x in self.cut_words(text)]
+        return self._cached("lcut_words", text, lambda x: [w[0] for w in self.cut_words(x)])
 
     @abc.abstractmethod
     def cut_for_search(self, text: str) -> list[str]:
@@ -51,15 +214,71 @@ class BaseTokenize(abc.ABC):
             self._sqlite_tokenize = fts5.make_fts5_tokenizer(CustomTokenize())
         return self._sqlite_tokenize
 
-    def as_pg_tokenize(self):
-        if self._pg_tokenize is None:
-            def tokenize(text: str) -> str:
-                res = {}
-                for t,s,e in self.cut_words(text):
-                    if t not in res:
-                        res[t] = f"'{t}':{s+1}"
-                    else:
-                        res[t] = res[t] + f",{s+1}"
-                return " ".join(res.values())
-            self._pg_tokenize = tokenize
-        return self._pg_tokenize
+    def to_tsvector(self, text: str) -> str:
+        '''
+        tokenize text to postgres tsvector string: 'word':pos1,pos2 ...
+        '''
+        res = {}
+        for t,s,e in self.cut_words(text):
+            if t not in res:
+                res[t] = f"'{t}':{s+1}"
+            else:
+                res[t] = res[t] + f",{s+1}"
+        return " ".join(res.values())
+
+    def batch_to_tsvector(self, texts: t.List[str]) -> t.List[str]:
+        '''
+        tokenize texts to tsvector strings in input order, in worker processes if enabled.
+        '''
+        return self._batch_call("to_tsvector", texts)
+
+    def to_fts_text(self, text: str) -> str:
+        '''
+        tokenize text to space joined tokens, which can be indexed by the builtin unicode61 tokenizer of sqlite fts5
+        '''
+        return " ".join(self.lcut_words(text))
+
+    def batch_to_fts_text(self, texts: t.List[str]) -> t.List[str]:
+        '''
+        tokenize texts to space joined tokens in input order, in worker processes if enabled.
+        '''
+        return self._batch_call("to_fts_text", texts)
+
+    def _batch_call(self, method: str, texts: t.List[str]) -> t.List[str]:
+        if self.processes == 0 or len(texts) < self.min_batch_size:
+            func = getattr(self, method)
+            return [func(x) for x in texts]
+
+        # a few chunks per worker to balance long and short texts
+        chunk_size = max(1, -(-len(texts) // (self._workers() * 4)))
+        chunks = [texts[i:i+chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = self._get_pool().map(functools.partial(_worker_call, method), chunks)
+        return [x for chunk in results for x in chunk]
+
+    def _workers(self) -> int:
+        return self.processes or os.cpu_count() or 1
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers(),
+                    initializer=_init_worker,
+                    initargs=(self,),
+                )
+            return self._pool
+
+    def close(self):
+        '''
+        shutdown worker processes of batch_to_tsvector
+        '''
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def as_pg_tokenize(self) -> t.Callable[[str], str]:
+        '''
+        the returned method is bound to tokenizer, so postgres stores use batch_to_tsvector when inserting documents.
+        '''
+        return self.to_tsvector
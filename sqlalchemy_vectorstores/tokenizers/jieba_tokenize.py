@@ -1,65 +1,164 @@
 from __future__ import annotations
 
+import functools
+from pathlib import Path
 import re
+import threading
 import typing as t
 
-from .base import BaseTokenize
+from .base import BaseTokenize, _parse_word
+
+
+_SCOPED_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s", re.VERBOSE: "x"}
+
+
+@functools.lru_cache()
+def _compile_skip_patterns(patterns: t.Tuple[str | re.Pattern, ...]) -> re.Pattern:
+    '''
+    combine skip patterns to one regex, so a token is matched once.
+    '''
+    def to_group(p: str | re.Pattern) -> str:
+        if isinstance(p, str):
+            return f"(?:{p})"
+        flags = "".join(c for f, c in _SCOPED_FLAGS.items() if p.flags & f)
+        return f"(?{flags}:{p.pattern})"
+
+    if not patterns:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(to_group(p) for p in patterns))
 
 
 class JiebaTokenize(BaseTokenize):
+    '''
+    the jieba dictionary is loaded on first use, or in a background thread if `background=True`.
+    `cache_file` is the path to cache the prefix dict built from the dictionary, so later processes load it quickly.
+    tokens matching any of `skip_patterns` or in stop words are skipped, set `hmm=False` to disable jieba's HMM for new words.
+    '''
     def __init__(
         self,
         stop_words: t.List[str] = [],
         user_dict: t.List[str, t.Tuple, t.Dict] = [],
+        cache_file: str | None = None,
+        background: bool = False,
+        skip_patterns: t.List[str | re.Pattern] = [r"\s+"],
+        hmm: bool = True,
+        processes: int | None = 0,
+        min_batch_size: int = 64,
+        cache_size: int = 1024,
+        cache_max_len: int = 100,
     ) -> None:
-        super().__init__(stop_words=stop_words, user_dict=user_dict)
+        super().__init__(stop_words=stop_words, user_dict=user_dict,
+                         processes=processes, min_batch_size=min_batch_size,
+                         cache_size=cache_size, cache_max_len=cache_max_len)
+        self.cache_file = cache_file
+        self.skip_patterns = skip_patterns
+        self.hmm = hmm
+        self._stop_words_set: t.FrozenSet[str] = frozenset()
+        self._skip_regex = _compile_skip_patterns(tuple(skip_patterns))
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        if background:
+            threading.Thread(target=self.initialize, daemon=True).start()
+
+    def __getstate__(self) -> t.Dict:
+        state = super().__getstate__()
+        state.update(_initialized=False, _init_lock=None)
+        return state
+
+    def __setstate__(self, state: t.Dict):
+        super().__setstate__(state)
+        self._init_lock = threading.Lock()
+
+    def initialize(self):
+        '''
+        load the jieba dictionary and add words of user dict. it's called automatically before cutting words.
+        '''
+        if self._initialized:
+            return
+
+        with self._init_lock:
+            if self._initialized:
+                return
+
+            import jieba
+            if self.cache_file:
+                jieba.dt.cache_file = str(Path(self.cache_file).absolute())
+            jieba.initialize()
+            self._add_words(self.load_user_dict())
+            self._stop_words_set = frozenset(self.load_stop_words())
+            self._initialized = True
 
+    def _add_words(self, user_dict: t.List[str, t.Tuple, t.Dict]):
         import jieba
-        jieba.initialize()
-        for w in self.load_user_dict():
-            word = None
-            freq = None
-            tag = None
-
-            if isinstance(w, str):
-                word = w
-            elif isinstance(w, (tuple, list)):
-                if len(w) >= 1:
-                    word = w[0]
-                if len(w) >= 2:
-                    freq = w[1]
-                if len(w) >= 3:
-                    tag = w[2]
-            elif isinstance(w, dict):
-                word = w.get("word")
-                freq = w.get("freq")
-                tag = w.get("tag")
-            jieba.add_word(word, freq, tag)
+
+        for w in user_dict:
+            jieba.add_word(*_parse_word(w))
+
+    def _cache_options(self) -> t.Tuple:
+        return (self.hmm,)
+
+    def set_stop_words(self, stop_words: t.List[str]):
+        self._stop_words_set = frozenset(stop_words)
+        super().set_stop_words(stop_words)
+
+    def add_user_words(self, user_dict: t.List[str, t.Tuple, t.Dict]):
+        '''
+        add words to the jieba dictionary, which is shared by all JiebaTokenize instances
+        '''
+        with self._init_lock:
+            if self._initialized:
+                self._add_words(user_dict)
+            super().add_user_words(user_dict)
+
+    def apply_words(self, rows: t.List[t.Dict]) -> t.List[str]:
+        '''
+        apply changed rows of words table, user words are added to or deleted from the jieba dictionary.
+        '''
+        import jieba
+
+        with self._init_lock:
+            user_words = {_parse_word(x)[0] for x in self._user_dict}
+            words = self._merge_words(rows)
+            self._stop_words_set = frozenset(self._stop_words)
+            if self._initialized:
+                for x in rows:
+                    if x["status"] == 1:
+                        jieba.add_word(x["word"], x["freq"], x["tag"])
+                    elif x["word"] in user_words:
+                        jieba.del_word(x["word"])
+            self.clear_cache()
+        return words
 
     def cut_words(
         self,
         text: str,
-        skip_patterns: t.List[re.Pattern]=[re.compile(r"\s+")],
+        skip_patterns: t.List[str | re.Pattern] | None = None,
     ) -> t.Generator[t.Tuple[str, int, int], None, None]:
         '''
         jieba 分词
         '''
         import jieba
 
-        stop_words = self.load_stop_words()
-        for word,s,e in jieba.tokenize(text):
-            skip = False
-            if word in stop_words or word.lower() in stop_words:
-                skip = True
-            for p in skip_patterns:
-                if p.match(word):
-                    skip = True
-                    break
-            if skip:
+        self.initialize()
+        stop_words = self._stop_words_set
+        if skip_patterns is None:
+            skip_match = self._skip_regex.match
+        else:
+            skip_match = _compile_skip_patterns(tuple(skip_patterns)).match
+        for word, s, e in jieba.tokenize(text, HMM=self.hmm):
+            if skip_match(word):
+                continue
+            lower = word.lower()
+            if lower in stop_words or word in stop_words:
                 continue
-            yield word.lower(), s, e
+            yield lower, s, e
 
     def cut_for_search(self, text: str) -> list[str]:
         import jieba
 
-        return [x.lower() for x in jieba.lcut_for_search(text) if x.strip()]
+        self.initialize()
+        return self._cached(
+            "cut_for_search",
+            text,
+            lambda x: [w.lower() for w in jieba.lcut_for_search(x, HMM=self.hmm) if w.strip()],
+        )
@@ -1,6 +1,26 @@
-from .base import BaseVectorStore
-from .base_async import AsyncBaseVectorStore
-from .sqlite import SqliteVectorStore
-from .sqlite_async import AsyncSqliteVectorStore
-from .postgres import PostgresVectorStore
-from .postgres_async import AsyncPostgresVectorStore
+from __future__ import annotations
+
+import typing as t
+
+from sqlalchemy_vectorstores._lazy import lazy_attrs
+
+if t.TYPE_CHECKING:
+    from .base import BaseVectorStore
+    from .base_async import AsyncBaseVectorStore
+    from .sqlite import SqliteVectorStore
+    from .sqlite_async import AsyncSqliteVectorStore
+    from .postgres import PostgresVectorStore
+    from .postgres_async import AsyncPostgresVectorStore
+
+
+_LAZY_IMPORTS = {
+    "BaseVectorStore": ".base",
+    "AsyncBaseVectorStore": ".base_async",
+    "SqliteVectorStore": ".sqlite",
+    "AsyncSqliteVectorStore": ".sqlite_async",
+    "PostgresVectorStore": ".postgres",
+    "AsyncPostgresVectorStore": ".postgres_async",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+__getattr__, __dir__ = lazy_attrs(__name__, _LAZY_IMPORTS)
@@ -2,13 +2,33 @@ from __future__ import annotations
 
 import abc
 import asyncio
+import functools
 import typing as t
+import uuid
 
 import sqlalchemy as sa
 from sqlalchemy.ext.asyncio import AsyncConnection
 
 from sqlalchemy_vectorstores.databases import AsyncBaseDatabase
-from sqlalchemy_vectorstores.vectorstores.utils import _select_first_to_dict
+from sqlalchemy_vectorstores.tokenizers.base import BaseTokenize, _parse_word
+from sqlalchemy_vectorstores.vectorstores.base import SCHEMA_VERSION, _fused_select, _group_limits, _matches_all, _grouped_select, _mmr_select, _expand_windows, _dedupe_targets
+from sqlalchemy_vectorstores.vectorstores.filters import FilterCompiler
+from sqlalchemy_vectorstores.vectorstores.utils import _select_first_to_dict, _count_words, _DOC_DEFAULTS, Document
+
+if t.TYPE_CHECKING:
+    import numpy as np
+
+
+def _lazy_init(func: t.Callable) -> t.Callable:
+    '''
+    create tables before the first call of a method if the store is initialized lazily
+    '''
+    @functools.wraps(func)
+    async def wrapper(self: AsyncBaseVectorStore, *args, **kwds):
+        if not self._initialized:
+            await self._ensure_init()
+        return await func(self, *args, **kwds)
+    return wrapper
 
 
 class AsyncBaseVectorStore(abc.ABC):
@@ -27,49 +47,336 @@ class AsyncBaseVectorStore(abc.ABC):
         fts_table: str = "",
         vec_table: str = "",
         words_table: str = "",
+        tag_table: str = "",
+        edge_table: str = "",
+        manifest_table: str = "",
         table_prefix: str = "rag",
+        use_tag_table: bool = False,
+        use_edge_table: bool = False,
+        use_manifest: bool = True,
         fts_tokenize: t.Callable[[str], str] | None = None,
         fts_language: str = "english",
         embedding_func: t.Callable[[str], t.List[float]] | t.Callable[[t.List[str]], t.List[t.List[float]]] | None = None,
+        batch_embedding_func: t.Callable[[t.List[str]], t.List[t.List[float]]] | None = None,
+        embedding_model: str = "",
+        count_words: t.Callable[[str], int] | None = None,
         dim: int | None = None,
         clear_existed: bool = False,
+        lazy_init: bool = False,
     ) -> None:
+        '''
+        tables are created in __init__ if no event loop is running,
+        otherwise(or lazy_init=True) they are created on first use without blocking the loop.
+        use `await AsyncXXXVectorStore.create(...)` to create tables explicitly in async code.
+        '''
         self.db = db
         self._src_table = src_table or f"{table_prefix}_src"
         self._doc_table = doc_table or f"{table_prefix}_doc"
         self._fts_table = fts_table or f"{table_prefix}_fts"
         self._vec_table = vec_table or f"{table_prefix}_vec"
         self._words_table = words_table or f"{table_prefix}_words"
+        self._tag_table = tag_table or f"{table_prefix}_tag"
+        self._edge_table = edge_table or f"{table_prefix}_edge"
+        self._manifest_table = manifest_table or f"{table_prefix}_manifest"
+        self.use_tag_table = use_tag_table
+        self.use_edge_table = use_edge_table
+        self.use_manifest = use_manifest
         self.fts_tokenize = fts_tokenize
         self.fts_language = fts_language
         self.embedding_func = embedding_func
+        self.batch_embedding_func = batch_embedding_func
+        self.embedding_model = embedding_model
+        self.count_words = count_words or self._default_count_words()
         self.dim = dim
         self._con = None # TODO: optimize connection performance
-        asyncio.run(self.init_database(clear_existed=clear_existed))
+        self._filter_compiler = FilterCompiler(self)
+        self._clear_existed = clear_existed
+        self._initialized = False
+        self._init_lock: asyncio.Lock | None = None
+        if not lazy_init:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                asyncio.run(self.init_database(clear_existed=clear_existed))
+
+    @classmethod
+    async def create(cls, db: AsyncBaseDatabase, **kwds) -> AsyncBaseVectorStore:
+        '''
+        create a vector store and it's tables in a running event loop
+        '''
+        vs = cls(db, lazy_init=True, **kwds)
+        await vs._ensure_init()
+        return vs
+
+    async def _ensure_init(self):
+        if self._initialized:
+            return
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if not self._initialized:
+                await self.init_database(clear_existed=self._clear_existed)
+
+    async def _run_ddl(self, *aws: t.Awaitable):
+        '''
+        run table creations concurrently if the database allows, otherwise one by one
+        '''
+        if self.db.concurrent_ddl:
+            await asyncio.gather(*aws)
+        else:
+            for x in aws:
+                await x
 
     async def init_database(self, clear_existed: bool = False):
         '''
-        create all tables
+        create all tables.
+        if the manifest matches settings of the store, tables are defined without DDL and dim is read from it,
+        so only one query is needed. otherwise the embedding dim is probed while creating tables that don't need it.
         '''
-        if self.embedding_func is not None and self.dim is None:
-            self.dim = len(await self.embedding_func("hello world"))
+        async def probe_dim():
+            if self.embedding_func is not None and self.dim is None:
+                self.dim = len(await self.embedding_func("hello world"))
 
         if clear_existed:
             await self.drop_all_tables()
-        await self.db.create_src_table(self._src_table)
-        await self.db.create_doc_table(self._doc_table)
-        await self.db.create_fts_table(self._fts_table, self._doc_table, self.fts_tokenize)
-        await self.db.create_vec_table(self._vec_table, self._doc_table, self.dim)
-        await self.db.create_words_table(self._words_table)
+        elif self.use_manifest and (await self._load_manifest()):
+            self._initialized = True
+            return
 
-    async def drop_all_tables(self):
-        await self.db.drop_tables(
-            self._src_table,
-            self._doc_table,
-            self._fts_table,
-            self._vec_table,
-            self._words_table
+        tables = [
+            self.db.create_src_table(self._src_table),
+            self.db.create_doc_table(self._doc_table),
+            self.db.create_words_table(self._words_table),
+        ]
+        if self.use_tag_table:
+            tables.append(self.db.create_tag_table(self._tag_table))
+        if self.use_edge_table:
+            tables.append(self.db.create_edge_table(self._edge_table))
+        if self.use_manifest:
+            tables.append(self.db.create_manifest_table(self._manifest_table))
+        await asyncio.gather(probe_dim(), self._run_ddl(*tables))
+        # fts triggers need the document table, vec table needs the dim
+        await self._run_ddl(
+            self.db.create_fts_table(self._fts_table, self._doc_table, self.fts_tokenize),
+            self.db.create_vec_table(self._vec_table, self._doc_table, self.dim),
         )
+        if f"{self._doc_table}.word_count" in (await self.db.ensure_columns(*self._regular_tables())):
+            await self._backfill_word_count()
+        await self.db.ensure_indexes(*self._table_names())
+        if self.use_manifest:
+            await self._save_manifest()
+        self._initialized = True
+
+    def _table_map(self) -> t.Dict[str, str]:
+        '''
+        table names by kind, saved in manifest
+        '''
+        tables = {
+            "src": self._src_table,
+            "doc": self._doc_table,
+            "fts": self._fts_table,
+            "vec": self._vec_table,
+            "words": self._words_table,
+        }
+        if self.use_tag_table:
+            tables["tag"] = self._tag_table
+        if self.use_edge_table:
+            tables["edge"] = self._edge_table
+        return tables
+
+    def _regular_tables(self) -> t.List[str]:
+        '''
+        tables can be altered, not virtual tables
+        '''
+        tables = [self._src_table, self._doc_table, self._words_table]
+        if self.use_tag_table:
+            tables.append(self._tag_table)
+        if self.use_edge_table:
+            tables.append(self._edge_table)
+        return tables
+
+    def _table_names(self) -> t.List[str]:
+        return (list(self._table_map().values())
+                + ([self._manifest_table] if self.use_manifest else []))
+
+    def _manifest_data(self) -> t.Dict:
+        tables = self._table_map()
+        indexes = [[table, path, type] for (table, path), type in self.db._metadata_indexes.items()
+                   if table in tables.values()]
+        if self.fts_tokenize is None or isinstance(self.fts_tokenize, str):
+            fts_tokenize = self.fts_tokenize
+        else:
+            fts_tokenize = getattr(self.fts_tokenize, "__qualname__", type(self.fts_tokenize).__qualname__)
+        return {
+            "id": 1,
+            "schema_version": SCHEMA_VERSION,
+            "dim": self.dim,
+            "embedding_model": self.embedding_model,
+            "fts_tokenize": fts_tokenize,
+            "tables": tables,
+            "metadata": {"metadata_indexes": indexes},
+        }
+
+    def _check_manifest(self, manifest: t.Dict | None) -> bool:
+        '''
+        whether tables described by the manifest can be used without checking.
+        raise error if the existing store is incompatible with settings.
+        '''
+        if (manifest is None
+            or manifest["schema_version"] != SCHEMA_VERSION
+            or manifest["tables"] != self._table_map()):
+            return False
+        if (self.embedding_model and manifest["embedding_model"]
+            and self.embedding_model != manifest["embedding_model"]):
+            raise RuntimeError(f"embedding model {self.embedding_model} mismatches {manifest['embedding_model']} "
+                               "of the existing store, use clear_existed=True to rebuild it")
+        if manifest["dim"] is None:
+            return self.dim is None and self.embedding_func is None
+        if self.dim is not None and self.dim != manifest["dim"]:
+            raise RuntimeError(f"dim {self.dim} mismatches {manifest['dim']} of the existing store, "
+                               "use clear_existed=True to rebuild it")
+        return True
+
+    async def _load_manifest(self) -> bool:
+        '''
+        define tables from the manifest without DDL.
+        return False if the manifest doesn't exist or is out of date.
+        '''
+        table = await self.db.create_manifest_table(self._manifest_table, emit_ddl=False)
+        try:
+            async with self.connect() as con:
+                manifest = _select_first_to_dict(await con.execute(sa.select(table)))
+        except sa.exc.DBAPIError:
+            self.db.metadata.remove(table)
+            return False
+        if not self._check_manifest(manifest):
+            return False
+
+        self.dim = manifest["dim"]
+        await self.db.create_src_table(self._src_table, emit_ddl=False)
+        await self.db.create_doc_table(self._doc_table, emit_ddl=False)
+        await self.db.create_fts_table(self._fts_table, self._doc_table, self.fts_tokenize, emit_ddl=False)
+        await self.db.create_vec_table(self._vec_table, self._doc_table, self.dim, emit_ddl=False)
+        await self.db.create_words_table(self._words_table, emit_ddl=False)
+        if self.use_tag_table:
+            await self.db.create_tag_table(self._tag_table, emit_ddl=False)
+        if self.use_edge_table:
+            await self.db.create_edge_table(self._edge_table, emit_ddl=False)
+        for table_name, path, type in (manifest["metadata"] or {}).get("metadata_indexes", []):
+            self.db._metadata_indexes[(table_name, path)] = type
+        return True
+
+    async def _save_manifest(self):
+        t = self.manifest_table
+        async with self.connect() as con:
+            await con.execute(sa.delete(t))
+            await con.execute(sa.insert(t).values(self._manifest_data()))
+            await con.commit()
+
+    async def drop_all_tables(self):
+        await self.db.drop_tables(*self._table_names())
+
+    @_lazy_init
+    async def list_indexes(self) -> t.Dict[str, t.List[t.Dict]]:
+        '''
+        indexes exist in database of all tables
+        '''
+        return {x: (await self.db.list_indexes(x)) for x in self._table_names()}
+
+    @_lazy_init
+    async def ensure_columns(self) -> t.List[str]:
+        '''
+        add missing columns to stores created by older versions without rebuilding tables.
+        return names of the added columns
+        '''
+        return await self.db.ensure_columns(*self._regular_tables())
+
+    def _default_count_words(self) -> t.Callable[[str], int]:
+        '''
+        count words by the tokenizer of store if any, otherwise approximately by regex
+        '''
+        tokenize = self.fts_tokenize
+        if not isinstance(tokenize, BaseTokenize):
+            tokenize = getattr(tokenize, "__self__", None)
+        if isinstance(tokenize, BaseTokenize):
+            # documents are not query-sized, count them without the words cache
+            return lambda text: len(list(tokenize.cut_words(text or "")))
+        return _count_words
+
+    async def _backfill_word_count(self, chunk_size: int = 500) -> int:
+        t = self.doc_table
+        stmt = sa.select(t.c.id, t.c.content).where(t.c.word_count.is_(None)).limit(chunk_size)
+        update = sa.update(t).where(t.c.id==sa.bindparam("b_id")).values(word_count=sa.bindparam("b_word_count"))
+        count = 0
+        loop = asyncio.get_running_loop()
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            while True:
+                docs = (await con.execute(stmt)).all()
+                if docs:
+                    counts = await loop.run_in_executor(None, lambda: [self.count_words(x.content) for x in docs])
+                    await con.execute(update, [{"b_id": x.id, "b_word_count": y} for x, y in zip(docs, counts)])
+                    await con.commit()
+                    count += len(docs)
+                if len(docs) < chunk_size:
+                    break
+        return count
+
+    @_lazy_init
+    async def backfill_word_count(self, chunk_size: int = 500) -> int:
+        '''
+        fill `word_count` of documents added by older versions, it runs at startup if the column is added.
+        every chunk_size documents are updated in one transaction. return count of updated documents.
+        '''
+        return await self._backfill_word_count(chunk_size)
+
+    @_lazy_init
+    async def ensure_indexes(self) -> t.List[str]:
+        '''
+        add missing indexes to stores created by older versions without rebuilding tables.
+        return names of the created indexes
+        '''
+        return await self.db.ensure_indexes(*self._table_names())
+
+    @_lazy_init
+    async def create_metadata_index(
+        self,
+        path: str = "",
+        type: t.Literal["text", "number", "gin"] = "text",
+        table: t.Literal["doc", "src"] = "doc",
+    ) -> str:
+        '''
+        index a metadata path of documents or sources,
+        metadata filters built by `db.make_filter` will use the index automatically.
+        return the index name
+        '''
+        table_name = self._doc_table if table == "doc" else self._src_table
+        name = await self.db.create_metadata_index(table_name, path, type)
+        if self.use_manifest:
+            await self._save_manifest()
+        return name
+
+    def make_filters(
+        self,
+        filters: t.Dict | t.List[sa.sql._typing.ColumnExpressionArgument | t.Dict] | None,
+    ) -> t.List[sa.sql._typing.ColumnExpressionArgument]:
+        '''
+        build filters from declarative dicts, sqlalchemy expressions are kept as is. for example:
+            {"type": {"$in": ["origin", "summary"]}, "src.metadata.year": {"$gte": 2020}, "tags": {"$all": ["a", "b"]}}
+        see FilterCompiler for the syntax.
+        tables must be created, use `create` or await `_ensure_init` for a lazily initialized store.
+        '''
+        if not filters:
+            return []
+        if isinstance(filters, dict):
+            return list(self._filter_compiler.compile(filters))
+        res = []
+        for x in filters:
+            if isinstance(x, dict):
+                res += self._filter_compiler.compile(x)
+            else:
+                res.append(x)
+        return res
 
     @property
     def src_table(self) -> sa.Table:
@@ -91,9 +398,22 @@ class AsyncBaseVectorStore(abc.ABC):
     def words_table(self) -> sa.Table:
         return self.db.tables[self._words_table]
 
+    @property
+    def tag_table(self) -> sa.Table:
+        return self.db.tables[self._tag_table]
+
+    @property
+    def edge_table(self) -> sa.Table:
+        return self.db.tables[self._edge_table]
+
+    @property
+    def manifest_table(self) -> sa.Table:
+        return self.db.tables[self._manifest_table]
+
     def connect(self) -> AsyncConnection:
         return self.db.connect()
 
+    @_lazy_init
     async def add_source(
         self,
         src: str,
@@ -113,70 +433,259 @@ class AsyncBaseVectorStore(abc.ABC):
         }
         async with self.connect() as con:
             stmt = sa.insert(self.src_table).values(data)
-            res = await con.execute(stmt)
+            src_id = (await con.execute(stmt)).inserted_primary_key[0]
+            if self.use_tag_table:
+                await self._set_tags(con, src_id, tags)
             await con.commit()
-            return res.inserted_primary_key[0]
+            return src_id
 
+    async def _set_tags(self, con: AsyncConnection, src_id: str, tags: t.List[str]):
+        '''
+        replace rows of a source in tag table
+        '''
+        t = self.tag_table
+        await con.execute(sa.delete(t).where(t.c.src_id==src_id))
+        if tags:
+            await con.execute(sa.insert(t), [{"src_id": src_id, "tag": x} for x in set(tags)])
+
+    @_lazy_init
+    async def sync_tag_table(self) -> int:
+        '''
+        fill the tag table from tags column of sources, used after enabling use_tag_table on an existing store.
+        return count of tag rows
+        '''
+        rows = []
+        async with self.connect() as con:
+            t = self.src_table
+            for src_id, tags in (await con.execute(sa.select(t.c.id, t.c.tags))):
+                rows += [{"src_id": src_id, "tag": x} for x in set(tags or [])]
+            await con.execute(sa.delete(self.tag_table))
+            if rows:
+                await con.execute(sa.insert(self.tag_table), rows)
+            await con.commit()
+        return len(rows)
+
+    @_lazy_init
     async def upsert_source(self, data: dict) -> str:
         async with self.connect() as con:
             t = self.src_table
             if id := data.pop("id", None):
-                existed = await self.get_source_by_id(id)
+                existed = (await con.execute(sa.select(t.c.id).where(t.c.id==id))).first()
                 if existed is not None:
                     stmt = sa.update(t).values(data).where(t.c.id==id)
                     await con.execute(stmt)
+                    if self.use_tag_table and "tags" in data:
+                        await self._set_tags(con, id, data["tags"] or [])
                     await con.commit()
                     return id
         return await self.add_source(**data)
 
+    @_lazy_init
     async def clear_source(self, id: str) -> t.Tuple[int, int, int]:
         '''
         clear all documents and vectors of a source, keep the source record
         return the count of deleted documents/vectors
         '''
-        doc_ids = [x["id"] for x in (await self.get_documents_of_source(id))]
-        doc_count = await self.db.delete_by_ids(self.doc_table, doc_ids)
-        vec_count = await self.db.delete_by_ids(self.vec_table, doc_ids, "doc_id")
-        fts_count = await self.db.delete_by_ids(self.fts_table, doc_ids, "id")
-        return doc_count, vec_count, fts_count
+        return await self.delete_where([self.doc_table.c.src_id==id])
+
+    async def _delete_sources(self, con: AsyncConnection, src_ids: t.List[str] | sa.Select) -> int:
+        '''
+        delete sources and their tag rows by ids or a subquery of ids in the given connection
+        '''
+        if self.use_tag_table:
+            t = self.tag_table
+            await con.execute(sa.delete(t).where(t.c.src_id.in_(src_ids)))
+        t = self.src_table
+        return (await con.execute(sa.delete(t).where(t.c.id.in_(src_ids)))).rowcount
 
+    @_lazy_init
     async def delete_source(self, id: str) -> t.Tuple[int, int, int]:
         '''
-        delete source and it's documents/vectors completely
+        delete source and it's documents/vectors completely, the source is deleted with the last chunk of documents.
         '''
-        await self.db.delete_by_ids(self.src_table, id)
-        return await self.clear_source(id)
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            return await self._delete_where(con, [self.doc_table.c.src_id==id], src_ids=[id])
 
-    async def delete_source_by_src(self, src: str) -> t.Tuple[int, int, int]:
-        filters = [
-            self.db.make_filter(self.src_table.c.src, src)
-        ]
-        src_ids = [x["id"] for x in (await self.search_sources(filters))]
-        for src_id in src_ids:
-            await self.delete_source(src_id)
+    @_lazy_init
+    async def delete_source_by_src(self, src: str | t.List[str], chunk_size: int = 500) -> t.Tuple[int, int, int]:
+        '''
+        delete sources matched by src and their documents/vectors in one pass.
+        src is matched by `make_filter` if it is a string, or exactly if it is a list.
+        return the count of deleted documents/vectors
+        '''
+        t = self.src_table
+        if isinstance(src, str):
+            src_ids = sa.select(t.c.id).where(self.db.make_filter(t.c.src, src))
+        else:
+            src_ids = sa.select(t.c.id).where(self.db.make_ids_filter(t.c.src, src))
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            return await self._delete_where(con, [self.doc_table.c.src_id.in_(src_ids)], chunk_size, src_ids=src_ids)
 
-    async def search_sources(self, *filters: sa.sql._typing.ColumnExpressionArgument) -> t.List[t.Dict]:
+    @_lazy_init
+    async def search_sources(self, *filters: sa.sql._typing.ColumnExpressionArgument | t.Dict) -> t.List[t.Dict]:
+        if len(filters) == 1 and isinstance(filters[0], list):
+            filters = filters[0]
+        filters = self.make_filters(list(filters))
         async with self.connect() as con:
             stmt = self.src_table.select().where(*filters)
             return [x._asdict() for x in (await con.execute(stmt))]
 
+    @_lazy_init
     async def get_source_by_id(self, id: str) -> dict | None:
         async with self.connect() as con:
             t = self.src_table
             r = await con.execute(t.select().where(t.c.id==id))
             return _select_first_to_dict(r)
 
+    @_lazy_init
     async def get_sources_by_tags(
         self,
         *,
         tags_any: t.List[str] = [],
         tags_all: t.List[str] = [],
     ) -> t.List[t.Dict]:
+        filters = self.make_tags_filter(tags_any=tags_any, tags_all=tags_all)
+        return await self.search_sources(*filters)
+
+    def make_tags_filter(
+        self,
+        *,
+        tags_any: t.List[str] = [],
+        tags_all: t.List[str] = [],
+    ) -> t.List[sa.sql._typing.ColumnExpressionArgument]:
+        '''
+        build filters of source tags, which can be used in search_sources and filters of search methods.
+        with use_tag_table, they are semi-joins on the indexed tag table instead of LIKE on the tags column.
+        tables must be created, use `create` or await `_ensure_init` for a lazily initialized store.
+        '''
         t = self.src_table
-        expr1 = self.db.make_filter(t.c.tags, tags_any, "list_any")
-        expr2 = self.db.make_filter(t.c.tags, tags_all, "list_all")
-        return await self.search_sources(expr1, expr2)
+        filters = []
+        if not self.use_tag_table:
+            if tags_any:
+                filters.append(self.db.make_filter(t.c.tags, tags_any, "list_any"))
+            if tags_all:
+                filters.append(self.db.make_filter(t.c.tags, tags_all, "list_all"))
+            return filters
+
+        tt = self.tag_table
+        if tags_any:
+            filters.append(t.c.id.in_(sa.select(tt.c.src_id).where(tt.c.tag.in_(list(set(tags_any))))))
+        if tags_all:
+            tags_all = list(set(tags_all))
+            stmt = (sa.select(tt.c.src_id)
+                    .where(tt.c.tag.in_(tags_all))
+                    .group_by(tt.c.src_id)
+                    .having(sa.func.count() == len(tags_all)))
+            filters.append(t.c.id.in_(stmt))
+        return filters
+
+    async def _embed_texts(self, texts: t.List[str]) -> t.List[t.List[float]]:
+        '''
+        embed texts by one call of batch_embedding_func if given, otherwise one by one by embedding_func.
+        a single text is embedded by embedding_func if given.
+        '''
+        if not texts:
+            return []
+        if self.batch_embedding_func is not None and (len(texts) > 1 or self.embedding_func is None):
+            return list(await self.batch_embedding_func(texts))
+        return [(await self.embedding_func(x)) for x in texts]
+
+    async def _insert_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        '''
+        insert fts rows of new documents ({"id", "content"}) in the given connection.
+        do nothing by default, override it if the fts table is not synced by database triggers.
+        '''
 
+    async def _update_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        '''
+        update fts rows of changed documents ({"id", "content"}) in the given connection.
+        do nothing by default, override it if the fts table is not synced by database triggers.
+        '''
+
+    async def _insert_documents(self, con: AsyncConnection, docs: t.List[t.Dict]) -> t.List[str]:
+        '''
+        insert documents and their vectors/fts rows in the given connection.
+        an "embedding" key of document is used as it's vector.
+        '''
+        rows = []
+        vectors = []
+        for doc in docs:
+            doc = {**_DOC_DEFAULTS, **doc}
+            embedding = doc.pop("embedding", None)
+            doc.setdefault("id", str(uuid.uuid4()))
+            rows.append(doc)
+            if embedding is not None and len(embedding):
+                vectors.append({"doc_id": doc["id"], "embedding": embedding})
+        if texts := [x["content"] for x in rows if x.get("word_count") is None]:
+            counts = iter(await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [self.count_words(x) for x in texts]))
+            for x in rows:
+                if x.get("word_count") is None:
+                    x["word_count"] = next(counts)
+        # executemany requires same keys of all rows
+        keys = set().union(*rows)
+        rows = [{k: x.get(k) for k in keys} for x in rows]
+        await con.execute(sa.insert(self.doc_table), rows)
+        if vectors:
+            await con.execute(sa.insert(self.vec_table), vectors)
+        await self._insert_fts(con, [{"id": x["id"], "content": x["content"]} for x in rows])
+        if self.use_edge_table:
+            await self._insert_edges(con, rows)
+        return [x["id"] for x in rows]
+
+    async def _insert_edges(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        '''
+        insert edge rows of documents ({"id", "target_ids"}) in the given connection
+        '''
+        edges = [{"doc_id": x["id"], "target_id": y} for x in docs for y in dict.fromkeys(x.get("target_ids") or [])]
+        if edges:
+            await con.execute(sa.insert(self.edge_table), edges)
+
+    async def _delete_edges(self, con: AsyncConnection, ids: t.List[str]):
+        t = self.edge_table
+        await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.doc_id, ids)))
+
+    @_lazy_init
+    async def sync_edge_table(self) -> int:
+        '''
+        fill the edge table from target_ids column of documents, used after enabling use_edge_table on an existing store.
+        return count of edge rows
+        '''
+        async with self.connect() as con:
+            t = self.doc_table
+            docs = [x._asdict() for x in (await con.execute(sa.select(t.c.id, t.c.target_ids)))]
+            await con.execute(sa.delete(self.edge_table))
+            await self._insert_edges(con, docs)
+            await con.commit()
+        return sum(len(set(x["target_ids"] or [])) for x in docs)
+
+    @_lazy_init
+    async def add_documents(
+        self,
+        docs: t.List[Document | t.Dict],
+        chunk_size: int = 500,
+    ) -> t.List[str]:
+        '''
+        insert document chunks to database in batch, generate fts & vectors automatically.
+        documents without "embedding" are embedded by embedding_func, or by one call per batch of batch_embedding_func.
+        each batch of chunk_size documents is inserted in one transaction.
+        '''
+        ids = []
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            for i in range(0, len(docs), chunk_size):
+                batch = [dict(x) for x in docs[i:i+chunk_size]]
+                if self.embedding_func is not None or self.batch_embedding_func is not None:
+                    missed = [x for x in batch if x.get("embedding") is None]
+                    for doc, embedding in zip(missed, (await self._embed_texts([x["content"] for x in missed]))):
+                        doc["embedding"] = embedding
+                ids += await self._insert_documents(con, batch)
+                await con.commit()
+        return ids
+
+    @_lazy_init
     async def add_document(
         self,
         *,
@@ -198,57 +707,286 @@ class AsyncBaseVectorStore(abc.ABC):
             "type": type,
             "seq": seq,
             "target_ids": target_ids,
+            "embedding": embedding,
         }
-        if embedding is None and self.embedding_func is not None:
-            embedding = await self.embedding_func(content)
-        
-        async with self.connect() as con:
-            stmt = self.doc_table.insert().values(data)
-            doc_id = (await con.execute(stmt)).inserted_primary_key[0]
-            if embedding:
-                stmt = self.vec_table.insert().values(doc_id=doc_id, embedding=embedding)
-                await con.execute(stmt)
-            await con.commit()
-            return doc_id
+        return (await self.add_documents([data]))[0]
 
+    @_lazy_init
     async def upsert_document(self, data: dict) -> str: # TODO: update vectors?
         async with self.connect() as con:
             t = self.doc_table
             if id := data.get("id", None):
-                existed = await self.get_source_by_id(id)
+                existed = (await con.execute(sa.select(t.c.id).where(t.c.id==id))).first()
                 if existed is not None:
+                    if "content" in data and data.get("word_count") is None:
+                        word_count = await asyncio.get_running_loop().run_in_executor(
+                            None, self.count_words, data["content"])
+                        data = {**data, "word_count": word_count}
                     stmt = sa.update(t).values(data).where(t.c.id==id)
                     await con.execute(stmt)
+                    if "content" in data:
+                        await self._update_fts(con, [{"id": id, "content": data["content"]}])
+                    if self.use_edge_table and "target_ids" in data:
+                        await self._delete_edges(con, [id])
+                        await self._insert_edges(con, [{"id": id, "target_ids": data["target_ids"]}])
                     await con.commit()
                     return id
-        return await self.add_document(**data)
+        return (await self.add_documents([data]))[0]
 
-    async def delete_documents(self, ids: t.List[str]) -> t.Tuple[int, int, int]:
+    async def _delete_documents(self, con: AsyncConnection, ids: t.List[str]) -> t.Tuple[int, int, int]:
         '''
-        delete a document chunk and it's vectors
+        delete documents and their vectors/fts/edge rows by ids in the given connection
         '''
-        doc_count = await self.db.delete_by_ids(self.doc_table, ids, "id")
-        vec_count = await self.db.delete_by_ids(self.vec_table, id, "doc_id")
-        fts_count = await self.db.delete_by_ids(self.fts_table, id, "id")
+        if self.use_edge_table:
+            await self._delete_edges(con, ids)
+        t = self.doc_table
+        doc_count = (await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.id, ids)))).rowcount
+        t = self.vec_table
+        vec_count = (await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.doc_id, ids)))).rowcount
+        t = self.fts_table
+        fts_count = (await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.id, ids)))).rowcount
         return doc_count, vec_count, fts_count
 
-    async def search_documents(self, *filters: sa.sql._typing.ColumnExpressionArgument) -> t.List[t.Dict]:
+    @_lazy_init
+    async def delete_documents(self, ids: t.List[str], chunk_size: int = 500) -> t.Tuple[int, int, int]:
+        '''
+        delete document chunks and their vectors, every chunk_size documents are deleted in one transaction
+        '''
+        counts = [0, 0, 0]
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            for i in range(0, len(ids), chunk_size):
+                res = await self._delete_documents(con, ids[i:i+chunk_size])
+                counts = [x + y for x, y in zip(counts, res)]
+                await con.commit()
+        return tuple(counts)
+
+    async def _delete_where(
+        self,
+        con: AsyncConnection,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        chunk_size: int = 500,
+        src_ids: t.List[str] | sa.Select | None = None,
+    ) -> t.Tuple[int, int, int]:
+        '''
+        delete documents matched by built filters in chunks of the given connection, each chunk is committed.
+        sources of src_ids are deleted with the last chunk, in the same transaction.
+        '''
+        t1 = self.doc_table
+        t2 = self.src_table
+        stmt = (sa.select(t1.c.id)
+                .select_from(t1.outerjoin(t2, t1.c.src_id==t2.c.id))
+                .where(*filters)
+                .limit(chunk_size))
+        counts = [0, 0, 0]
+        while True:
+            ids = (await con.execute(stmt)).scalars().all()
+            if ids:
+                res = await self._delete_documents(con, ids)
+                counts = [x + y for x, y in zip(counts, res)]
+            if len(ids) < chunk_size:
+                if src_ids is not None:
+                    await self._delete_sources(con, src_ids)
+                await con.commit()
+                break
+            await con.commit()
+        return tuple(counts)
+
+    @_lazy_init
+    async def delete_where(
+        self,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict,
+        chunk_size: int = 500,
+    ) -> t.Tuple[int, int, int]:
+        '''
+        delete documents matched by filters and their vectors.
+        filters can reference both document and source table, same as `search_documents`.
+        documents are deleted in chunks, each chunk in one transaction, so large sources don't hold locks for long.
+        return the count of deleted documents/vectors
+        '''
+        filters = self.make_filters(filters)
+        if _matches_all(filters):
+            raise RuntimeError("delete_where requires filters, use drop_all_tables to clear the store")
+
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            return await self._delete_where(con, filters, chunk_size)
+
+    @_lazy_init
+    async def search_documents(self, *filters: sa.sql._typing.ColumnExpressionArgument | t.Dict) -> t.List[t.Dict]:
         if len(filters) == 1 and isinstance(filters[0], list):
             filters = filters[0]
+        filters = self.make_filters(list(filters))
         async with self.connect() as con:
-            stmt = self.doc_table.select().where(*filters)
+            t1 = self.doc_table
+            t2 = self.src_table
+            stmt = (sa.select(t1)
+                    .select_from(t1.outerjoin(t2, t1.c.src_id==t2.c.id))
+                    .where(*filters))
             return [x._asdict() for x in (await con.execute(stmt))]
 
+    def _doc_columns(
+        self,
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+    ) -> t.List[sa.Column | sa.Table]:
+        '''
+        columns of document table to select, all columns if None, id and the group_by column are always selected.
+        '''
+        t = self.doc_table
+        names = [group_by] if group_by else []
+        if columns is not None:
+            names = columns + names
+        if unknown := [x for x in names if x not in t.c]:
+            raise RuntimeError(f"unknown columns of document table: {unknown}")
+        if columns is None:
+            return [t]
+        return [t.c.id] + [t.c[x] for x in dict.fromkeys(names) if x != "id"]
+
+    @_lazy_init
     async def get_document_by_ids(self, ids: t.List[str]) -> t.List[dict]:
         async with self.connect() as con:
             t = self.doc_table
-            r = await con.execute(t.select().where(t.c.id==id))
+            r = await con.execute(t.select().where(self.db.make_ids_filter(t.c.id, ids)))
             return [x._asdict() for x in r]
 
+    @_lazy_init
+    async def fetch_documents(self, ids: t.List[str], columns: t.List[str] | None = None) -> t.List[t.Dict]:
+        '''
+        fetch chosen columns of documents in one query, in order of ids and missing documents are skipped.
+        used to materialize hits of searches with `columns=[]`, embeddings are selected only if "embedding" in columns.
+        '''
+        if not ids:
+            return []
+        with_embedding = columns is not None and "embedding" in columns
+        if with_embedding:
+            columns = [x for x in columns if x != "embedding"]
+        t = self.doc_table
+        stmt = sa.select(*self._doc_columns(columns)).where(self.db.make_ids_filter(t.c.id, ids))
+        if with_embedding:
+            v = self.vec_table
+            stmt = stmt.add_columns(v.c.embedding).outerjoin(v, v.c.doc_id==t.c.id)
+        async with self.connect() as con:
+            docs = {x.id: x._asdict() for x in (await con.execute(stmt))}
+        return [docs[x] for x in dict.fromkeys(ids) if x in docs]
+
+    def _neighbors_stmt(self, ids: t.List[str], window: int) -> sa.Select:
+        '''
+        documents within window of every hit in one query, by (src_id, seq) of the hits.
+        documents without seq (negative) have no neighbors.
+        '''
+        t = self.doc_table
+        h = sa.select(t.c.id, t.c.src_id, t.c.seq).where(self.db.make_ids_filter(t.c.id, ids)).subquery("h")
+        d = t.alias("d")
+        cond = sa.or_(d.c.id==h.c.id,
+                      sa.and_(h.c.seq >= 0,
+                              d.c.src_id==h.c.src_id,
+                              d.c.seq.between(h.c.seq - window, h.c.seq + window),
+                              d.c.seq >= 0))
+        return (sa.select(h.c.id.label("hit_id"), d.c.id, d.c.src_id, d.c.seq, d.c.content, d.c.word_count)
+                .select_from(h)
+                .join(d, cond))
+
+    @_lazy_init
+    async def expand_context(
+        self,
+        hits: t.List[t.Dict | str],
+        window: int = 1,
+        max_words: int | None = None,
+        count_words: t.Callable[[str], int] | None = None,
+        sep: str = "\n",
+    ) -> t.List[t.Dict]:
+        '''
+        expand hits (documents or ids, best first) with neighbor chunks of the same source (seq ± window),
+        neighbors of all hits are fetched in one query. overlapping windows are merged to passages:
+            {"src_id", "ids", "hit_ids", "seq_start", "seq_end", "content", "word_count", "score"}
+        passages are ordered by their best hit, chunks exceeding max_words are skipped, nearest neighbors first.
+        stored `word_count` of chunks is used, count_words (default `self.count_words`) counts chunks without it.
+        '''
+        hits = [{"id": x} if isinstance(x, str) else x for x in hits]
+        if not hits:
+            return []
+        async with self.connect() as con:
+            rows = [x._asdict() for x in (await con.execute(self._neighbors_stmt([x["id"] for x in hits], window)))]
+        return _expand_windows(hits, rows, max_words=max_words,
+                               count_words=count_words or self.count_words, sep=sep)
+
+    def _targets_stmt(self, ids: t.List[str], columns: t.List[str] | None = None) -> sa.Select:
+        '''
+        targets of hits by the edge table and hits without targets, as documents of (hit_id, ...)
+        '''
+        d = self.doc_table
+        e = self.edge_table
+        cols = self._doc_columns(columns)
+        targets = (sa.select(e.c.doc_id.label("hit_id"), *cols)
+                   .select_from(e.join(d, d.c.id==e.c.target_id))
+                   .where(self.db.make_ids_filter(e.c.doc_id, ids)))
+        others = (sa.select(d.c.id.label("hit_id"), *cols)
+                  .where(self.db.make_ids_filter(d.c.id, ids),
+                         ~sa.exists().where(e.c.doc_id==d.c.id)))
+        return sa.union_all(targets, others)
+
+    @_lazy_init
+    async def resolve_targets(self, hits: t.List[t.Dict | str], columns: t.List[str] | None = None) -> t.List[t.Dict]:
+        '''
+        replace hits (documents or ids, best first) by documents of their target_ids, hits without targets are kept.
+        targets are deduplicated, each has "hit_ids" and the best "score" of hits pointing to it.
+        with use_edge_table, targets of all hits are resolved in one join, otherwise target_ids are read first.
+        '''
+        hits = [{"id": x} if isinstance(x, str) else x for x in hits]
+        if not hits:
+            return []
+        ids = [x["id"] for x in hits]
+        if self.use_edge_table:
+            async with self.connect() as con:
+                rows = [x._asdict() for x in (await con.execute(self._targets_stmt(ids, columns)))]
+        else:
+            t = self.doc_table
+            async with self.connect() as con:
+                stmt = sa.select(t.c.id, t.c.target_ids).where(self.db.make_ids_filter(t.c.id, ids))
+                pointers = {x.id: x.target_ids or [x.id] for x in (await con.execute(stmt))}
+            docs = {x["id"]: x for x in (await self.fetch_documents([y for x in pointers.values() for y in x], columns))}
+            rows = [{"hit_id": x, **docs[y]} for x, targets in pointers.items() for y in targets if y in docs]
+        return _dedupe_targets(hits, rows)
+
+    @_lazy_init
+    async def get_referrers(
+        self,
+        ids: t.List[str],
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.Dict]:
+        '''
+        documents pointing to any of ids by target_ids, one row per (referrer, target) with a "target_id" key.
+        with use_edge_table it is a lookup of the target_id index, otherwise a LIKE scan of target_ids.
+        '''
+        if not ids:
+            return []
+        d = self.doc_table
+        cols = self._doc_columns(columns)
+        async with self.connect() as con:
+            if self.use_edge_table:
+                e = self.edge_table
+                stmt = (sa.select(e.c.target_id, *cols)
+                        .select_from(e.join(d, d.c.id==e.c.doc_id))
+                        .where(self.db.make_ids_filter(e.c.target_id, ids)))
+                return [x._asdict() for x in (await con.execute(stmt))]
+
+            # LIKE may match part of another id, check target_ids again
+            stmt = (sa.select(d.c.target_ids.label("_target_ids"), *cols)
+                    .where(sa.or_(*[sa.type_coerce(d.c.target_ids, sa.String).contains(x) for x in ids])))
+            res = []
+            for row in (await con.execute(stmt)):
+                row = row._asdict()
+                targets = set(row.pop("_target_ids") or [])
+                res += [{"target_id": x, **row} for x in dict.fromkeys(ids) if x in targets]
+            return res
+
+    @_lazy_init
     async def get_documents_of_source(self, source_id: str) -> t.List[t.Dict]:
         expr = self.db.make_filter(self.doc_table.c.src_id, source_id, "id")
         return await self.search_documents(expr)
 
+    @_lazy_init
     async def get_documents_by_meta(self, kw: t.Dict) -> t.List[t.Dict]:
         expr = [self.db.make_filter(self.doc_table.c.metadata, v, "dict", k) for k,v in kw.items()]
         return await self.search_documents(expr)
@@ -259,8 +997,35 @@ class AsyncBaseVectorStore(abc.ABC):
         query: str | t.List[float],
         top_k: int = 3,
         score_threshold: float | None = None,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
+        '''
+        search the nearest top_k documents of query.
+        with group_by (a column of document table), the nearest fetch_k candidates are grouped in sql,
+        best per_group documents of each group are returned, at most max_groups (default top_k) groups ordered by their best document.
+        fetch_k defaults to per_group * max_groups * 4, groups without documents in the candidates are missed.
+        '''
+        ...
+
+    @abc.abstractmethod
+    async def search_similar_to(
+        self,
+        doc_id: str,
+        top_k: int = 3,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.Dict]:
+        '''
+        search the nearest top_k documents of a stored document, excluding itself.
+        it's vector is read by a subquery of the same statement, so nothing is embedded.
+        return [] if the document has no vector.
+        '''
         ...
 
     @abc.abstractmethod
@@ -269,18 +1034,302 @@ class AsyncBaseVectorStore(abc.ABC):
         query: str,
         top_k: int = 3,
         score_threshold: float = 2,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
+        '''
+        search the best top_k documents matching query by full text.
+        with group_by (a column of document table), the best fetch_k candidates are grouped same as `search_by_vector`.
+        '''
+        ...
+
+    @abc.abstractmethod
+    async def _search_vector_batch(
+        self,
+        con: AsyncConnection,
+        vectors: t.List[t.List[float]],
+        top_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.List[t.Dict]]:
+        '''
+        k-NN documents of every vector in the given connection, results are aligned to vectors.
+        '''
+        ...
+
+    @_lazy_init
+    async def search_by_vector_batch(
+        self,
+        queries: t.List[str | t.List[float]],
+        top_k: int = 3,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        **kwargs,
+    ) -> t.List[t.List[t.Dict]]:
+        '''
+        search documents of many queries, string queries are embedded by one call of batch_embedding_func if given,
+        all queries run in one connection. extra kwargs are passed to `_search_vector_batch`, such as `strategy` of postgres.
+        '''
+        texts = [x for x in queries if isinstance(x, str)]
+        if texts:
+            assert self.embedding_func is not None or self.batch_embedding_func is not None
+            embeddings = iter(await self._embed_texts(texts))
+            queries = [next(embeddings) if isinstance(x, str) else x for x in queries]
+        if not queries:
+            return []
+        filters = self.make_filters(filters)
+        async with self.connect() as con:
+            res = await self._search_vector_batch(con, queries, top_k, filters, columns=columns, **kwargs)
+        if score_threshold is not None:
+            res = [[x for x in docs if x["score"] <= score_threshold] for docs in res]
+        return res
+
+    @abc.abstractmethod
+    def _vector_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select:
+        '''
+        select (id, score) of the nearest fetch_k documents, documents are joined only if filtered.
+        '''
         ...
 
+    @abc.abstractmethod
+    def _bm25_candidates(
+        self,
+        query: str,
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select | None:
+        '''
+        select (id, score) of the best fetch_k documents matching query, None if nothing to match.
+        '''
+        ...
+
+    def _mmr_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        **kwargs,
+    ) -> sa.Select:
+        '''
+        select (id, score, embedding) of the nearest fetch_k documents, decoded by `_embedding_matrix`.
+        '''
+        return self._vector_candidates(query, fetch_k, filters, **kwargs).add_columns(self.vec_table.c.embedding)
+
+    def _embedding_matrix(self, values: t.List) -> np.ndarray:
+        '''
+        float32 matrix of selected embeddings, one row per document
+        '''
+        import numpy as np
+        return np.asarray(values, dtype=np.float32)
+
+    @_lazy_init
+    async def search_by_mmr(
+        self,
+        query: str | t.List[float],
+        top_k: int = 3,
+        fetch_k: int | None = None,
+        lambda_mult: float = 0.5,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        **kwargs,
+    ) -> t.List[t.Dict]:
+        '''
+        search documents by maximal marginal relevance, numpy is required.
+        the nearest fetch_k (default top_k * 5) candidates are decoded to one matrix, then top_k of them are chosen
+        by similarity to query and diversity to chosen ones, lambda_mult is 1 for similarity only and 0 for diversity only.
+        documents are in order of choice with their vector score, extra kwargs are passed to `_vector_candidates`.
+        '''
+        if isinstance(query, str):
+            assert self.embedding_func is not None
+            query = await self.embedding_func(query)
+        filters = self.make_filters(filters)
+        stmt = self._mmr_candidates(query, fetch_k or top_k * 5, filters, **kwargs)
+        async with self.connect() as con:
+            rows = (await con.execute(stmt)).all()
+        if score_threshold is not None:
+            rows = [x for x in rows if x.score <= score_threshold]
+        if not rows:
+            return []
+        embeddings = self._embedding_matrix([x.embedding for x in rows])
+        chosen = [rows[i] for i in _mmr_select(query, embeddings, top_k, lambda_mult)]
+        docs = {x["id"]: x for x in (await self.fetch_documents([x.id for x in chosen], columns))}
+        return [{"score": x.score, **docs[x.id]} for x in chosen if x.id in docs]
+
+    @_lazy_init
+    async def search_hybrid(
+        self,
+        query: str,
+        top_k: int = 3,
+        fetch_k: int | None = None,
+        weights: t.Tuple[float, float] = (1.0, 1.0),
+        fusion: t.Literal["rrf", "linear"] = "rrf",
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        rrf_k: int = 60,
+        embedding: t.List[float] | None = None,
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        **kwargs,
+    ) -> t.List[t.Dict]:
+        '''
+        search documents by vector and bm25, fetch_k candidates of each are fused in a single statement.
+        weights are of (vector, bm25), a list of weight 0 is skipped.
+        with group_by, fetch_k candidates of each are fused and grouped same as `search_by_vector`.
+        the returned score is negative fused score, extra kwargs are passed to `_vector_candidates`,
+        such as `strategy` of postgres.
+        '''
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
+        fetch_k = limit if group_by else fetch_k or top_k * 4
+        filters = self.make_filters(filters)
+        candidates = []
+        if weights[0]:
+            if embedding is None:
+                assert self.embedding_func is not None
+                embedding = await self.embedding_func(query)
+            candidates.append((self._vector_candidates(embedding, fetch_k, filters, **kwargs), weights[0]))
+        if weights[1] and (stmt := self._bm25_candidates(query, fetch_k, filters)) is not None:
+            candidates.append((stmt, weights[1]))
+        if not candidates:
+            return []
+        stmt = _fused_select(candidates, self.doc_table, top_k=limit, fusion=fusion, rrf_k=rrf_k,
+                             columns=self._doc_columns(columns, group_by))
+        if group_by:
+            stmt = _grouped_select(stmt, group_by, per_group, max_groups)
+        async with self.connect() as con:
+            return [x._asdict() for x in (await con.execute(stmt))]
+
+    @_lazy_init
     async def get_stop_words(self, *filters: sa.sql._typing.ColumnExpressionArgument) -> t.List[str]:
         async with self.connect() as con:
             t = self.words_table
             stmt = sa.select(t.c.word).where(t.c.status==0).where(*filters)
             return [r[0] for r in (await con.execute(stmt))]
 
+    @_lazy_init
     async def get_user_dict(self, *filters: sa.sql._typing.ColumnExpressionArgument) -> t.List[dict]:
         async with self.connect() as con:
             t = self.words_table
             stmt = sa.select(t.c.word, t.c.freq, t.c.tag).where(t.c.status==1).where(*filters)
             return [r._asdict() for r in (await con.execute(stmt))]
+
+    async def _next_words_version(self, con: AsyncConnection) -> int:
+        '''
+        lock words table until commit and take the next version, so versions are committed in order
+        and tokenizers synced between two commits don't miss words of the later one.
+        '''
+        t = self.words_table
+        await self.db.lock_table(con, t)
+        return (await con.execute(sa.select(sa.func.coalesce(sa.func.max(t.c.version), 0) + 1))).scalar()
+
+    @_lazy_init
+    async def upsert_words(self, words: t.List[str | t.Tuple | t.Dict], status: int | None = 1) -> int:
+        '''
+        add or update words of words table, status 0: stop word, 1: user dict.
+        words are like user dict of tokenizers: word, (word, freq, tag) or {"word", "freq", "tag"}.
+        changed words get a new version, which is returned.
+        '''
+        rows = {}
+        for w in words:
+            word, freq, tag = _parse_word(w)
+            rows[word] = {"word": word, "freq": freq, "tag": tag, "status": status}
+        async with self.connect() as con:
+            t = self.words_table
+            version = await self._next_words_version(con)
+            stmt = sa.select(t.c.word).where(self.db.make_ids_filter(t.c.word, list(rows)))
+            existed = set((await con.execute(stmt)).scalars())
+            updates = [{**x, "b_word": w, "version": version} for w, x in rows.items() if w in existed]
+            inserts = [{**x, "version": version} for w, x in rows.items() if w not in existed]
+            if updates:
+                await con.execute(sa.update(t).where(t.c.word==sa.bindparam("b_word")), updates)
+            if inserts:
+                await con.execute(sa.insert(t), inserts)
+            await con.commit()
+        return version
+
+    @_lazy_init
+    async def delete_words(self, words: t.List[str]) -> int:
+        '''
+        mark words as not used, so tokenizers remove them when syncing. return the new version.
+        '''
+        async with self.connect() as con:
+            t = self.words_table
+            version = await self._next_words_version(con)
+            stmt = (sa.update(t)
+                    .where(self.db.make_ids_filter(t.c.word, words))
+                    .values(status=None, version=version))
+            await con.execute(stmt)
+            await con.commit()
+        return version
+
+    @_lazy_init
+    async def get_words_delta(self, since: int = 0) -> t.Tuple[t.List[t.Dict], int]:
+        '''
+        words changed after version `since` and the latest version.
+        since=0 returns all words, including ones without version written by older versions.
+        '''
+        async with self.connect() as con:
+            t = self.words_table
+            stmt = sa.select(t.c.word, t.c.freq, t.c.tag, t.c.status, t.c.version)
+            if since:
+                stmt = stmt.where(t.c.version > since)
+            rows = [r._asdict() for r in (await con.execute(stmt))]
+        return rows, max([since] + [x["version"] or 0 for x in rows])
+
+    @_lazy_init
+    async def sync_tokenizer(self, tokenize: BaseTokenize | None = None, reindex: bool = False) -> t.List[str]:
+        '''
+        apply words changed since `tokenize.words_version` to the tokenizer, default to the fts tokenizer of store.
+        documents containing the changed words are reindexed if `reindex`.
+        return the changed words.
+        '''
+        if tokenize is None:
+            # postgres stores keep the bound method of `as_pg_tokenize`
+            tokenize = getattr(self.fts_tokenize, "__self__", self.fts_tokenize)
+        if not isinstance(tokenize, BaseTokenize):
+            raise RuntimeError("sync_tokenizer requires a tokenizer instance")
+
+        rows, version = await self.get_words_delta(tokenize.words_version)
+        words = tokenize.apply_words(rows)
+        tokenize.words_version = version
+        if reindex and words:
+            await self.reindex_documents(words)
+        return words
+
+    @_lazy_init
+    async def reindex_documents(self, words: t.List[str] | None = None, chunk_size: int = 500) -> int:
+        '''
+        rebuild fts rows of documents containing any of words (all documents if None) after the tokenizer changed.
+        every chunk_size documents are reindexed in one transaction. return count of reindexed documents.
+        '''
+        t = self.doc_table
+        filters = []
+        if words is not None:
+            filters.append(sa.or_(*[t.c.content.icontains(x, autoescape=True) for x in words]))
+        count = 0
+        last_id = None
+        # commit per chunk, `connect` begins a single transaction
+        async with self.db.engine.connect() as con:
+            while True:
+                stmt = sa.select(t.c.id, t.c.content).where(*filters).order_by(t.c.id).limit(chunk_size)
+                if last_id is not None:
+                    stmt = stmt.where(t.c.id > last_id)
+                docs = [r._asdict() for r in (await con.execute(stmt))]
+                if not docs:
+                    break
+                await self._update_fts(con, docs)
+                await con.commit()
+                count += len(docs)
+                last_id = docs[-1]["id"]
+        return count
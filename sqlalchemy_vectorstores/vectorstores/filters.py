@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import json
+import threading
+import typing as t
+
+import sqlalchemy as sa
+
+from sqlalchemy_vectorstores.databases.base import _compare
+
+if t.TYPE_CHECKING:
+    from .base import BaseVectorStore
+    from .base_async import AsyncBaseVectorStore
+
+
+class FilterCompiler:
+    '''
+    compile declarative dict filters to sqlalchemy expressions of a vector store.
+
+    syntax:
+        {field: value} or {field: {operator: value, ...}}, multiple fields are joined by AND.
+        logical operators: {"$and": [filters, ...]}, {"$or": [filters, ...]}, {"$not": filters}
+        an empty "$and" matches all rows, an empty "$or" matches nothing.
+
+    fields:
+        - columns of document table: "id", "src_id", "content", "type", "seq", ...
+        - columns of source table: "src", "title", ... or any column with "src." prefix, e.g. "src.id"
+        - metadata paths: "metadata.a.b" for documents, "src.metadata.a.b" for sources
+        - "tags": source tags, value can be a tag, a list of tags(any), {"$in": [...]} or {"$all": [...]}
+
+    operators: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $like, $ilike, $exists.
+    a plain value means $eq and a list means $in, strings are compared exactly.
+
+    "$in"/"$nin" of columns use `make_ids_filter`, so large id sets like allowed sources are bound as one parameter.
+
+    compiled expressions are cached by the filters and metadata indexes of database,
+    filters larger than max_key_size (e.g. with large id sets) are not cached.
+    '''
+    def __init__(
+        self,
+        vs: BaseVectorStore | AsyncBaseVectorStore,
+        cache_size: int = 256,
+        max_key_size: int = 4096,
+    ) -> None:
+        self.vs = vs
+        self.cache_size = cache_size
+        self.max_key_size = max_key_size
+        self._cache: OrderedDict[str, t.Tuple[sa.ColumnElement, ...]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, filters: t.Dict) -> t.List[sa.sql._typing.ColumnExpressionArgument]:
+        if not filters:
+            return []
+
+        key = json.dumps(
+            [filters, sorted(self.vs.db._metadata_indexes.items())],
+            sort_keys=True,
+            default=repr,
+        )
+        if len(key) > self.max_key_size:
+            return [self._compile_dict(filters)]
+        with self._lock:
+            if (res := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                return list(res)
+
+        # cache tuples, callers may change the returned list
+        res = (self._compile_dict(filters),)
+        with self._lock:
+            self._cache[key] = res
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(res)
+
+    def _compile_dict(self, filters: t.Dict) -> sa.ColumnElement:
+        exprs = []
+        for key, value in filters.items():
+            # empty and_/or_ are deprecated and render no condition, start from their identity
+            if key == "$and":
+                exprs.append(sa.and_(sa.true(), *[self._compile_dict(x) for x in value]))
+            elif key == "$or":
+                exprs.append(sa.or_(sa.false(), *[self._compile_dict(x) for x in value]))
+            elif key == "$not":
+                exprs.append(sa.not_(self._compile_dict(value)))
+            elif key.startswith("$"):
+                raise RuntimeError(f"unsupported logical operator: {key}")
+            else:
+                exprs.append(self._compile_field(key, value))
+        if len(exprs) == 1:
+            return exprs[0]
+        return sa.and_(sa.true(), *exprs)
+
+    def _compile_field(self, field: str, cond: t.Any) -> sa.ColumnElement:
+        if field in ["tags", "src.tags"]:
+            return self._compile_tags(cond)
+
+        if isinstance(cond, dict):
+            if not cond or not all(k.startswith("$") for k in cond):
+                raise RuntimeError(f"invalid filter of {field}: {cond}, use dotted path to filter metadata")
+            ops = cond
+        elif isinstance(cond, (list, tuple, set)):
+            ops = {"$in": list(cond)}
+        else:
+            ops = {"$eq": cond}
+
+        table, name, path = self._resolve(field)
+        exprs = []
+        for op, value in ops.items():
+            if path is not None:
+                exprs.append(self.vs.db.make_json_filter(table.c[name], path, op, value))
+            elif op.lstrip("$") in ["in", "nin"]:
+                expr = self.vs.db.make_ids_filter(table.c[name], value)
+                exprs.append(expr if op.lstrip("$") == "in" else sa.not_(expr))
+            else:
+                exprs.append(_compare(table.c[name], op, value))
+        if len(exprs) == 1:
+            return exprs[0]
+        return sa.and_(*exprs)
+
+    def _compile_tags(self, cond: t.Any) -> sa.ColumnElement:
+        tags_any = []
+        tags_all = []
+        if isinstance(cond, str):
+            tags_any = [cond]
+        elif isinstance(cond, (list, tuple, set)):
+            tags_any = list(cond)
+        elif isinstance(cond, dict):
+            for op, value in cond.items():
+                if op == "$eq":
+                    tags_any.append(value)
+                elif op == "$in":
+                    tags_any += list(value)
+                elif op == "$all":
+                    tags_all += list(value)
+                else:
+                    raise RuntimeError(f"unsupported operator of tags: {op}")
+        else:
+            raise RuntimeError(f"invalid filter of tags: {cond}")
+        return sa.and_(sa.true(), *self.vs.make_tags_filter(tags_any=tags_any, tags_all=tags_all))
+
+    def _resolve(self, field: str) -> t.Tuple[sa.Table, str, str | None]:
+        '''
+        resolve field to (table, column name, json path)
+        '''
+        parts = field.split(".")
+        table = None
+        if len(parts) > 1 and parts[0] in ["src", "doc"]:
+            table = self.vs.src_table if parts[0] == "src" else self.vs.doc_table
+            parts = parts[1:]
+
+        name = parts[0]
+        if table is None:
+            table = self.vs.doc_table if name in self.vs.doc_table.c else self.vs.src_table
+        if name not in table.c:
+            raise RuntimeError(f"unknown filter field: {field}")
+
+        if name == "metadata" and len(parts) > 1:
+            return table, name, ".".join(parts[1:])
+        elif len(parts) > 1:
+            raise RuntimeError(f"unknown filter field: {field}")
+        return table, name, None
@@ -4,7 +4,11 @@ import typing as t
 
 import sqlalchemy as sa
 
-from .base import BaseVectorStore
+from sqlalchemy_vectorstores.tokenizers.base import BaseTokenize
+from .base import BaseVectorStore, _group_limits, _grouped_select
+
+if t.TYPE_CHECKING:
+    from .postgres_async import AsyncPostgresVectorStore
 
 
 _PGV_STRATEGY = t.Literal[
@@ -17,28 +21,121 @@ _PGV_STRATEGY = t.Literal[
 ]
 
 
+def _batch_tokenize(fts_tokenize: t.Callable[[str], str]) -> t.Callable[[t.List[str]], t.List[str]]:
+    '''
+    use `batch_to_tsvector` of the tokenizer if fts_tokenize is returned by `BaseTokenize.as_pg_tokenize`
+    '''
+    tokenize = getattr(fts_tokenize, "__self__", None)
+    if isinstance(tokenize, BaseTokenize):
+        return tokenize.batch_to_tsvector
+    return lambda texts: [fts_tokenize(x) for x in texts]
+
+
+def _vector_batch_stmt(
+    vs: PostgresVectorStore | AsyncPostgresVectorStore,
+    vectors: t.List[t.List[float]],
+    top_k: int,
+    filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    columns: t.List[str] | None = None,
+    strategy: _PGV_STRATEGY = "l2_distance",
+) -> sa.Select:
+    '''
+    k-NN of every vector by a LATERAL join over a VALUES list of (idx, embedding)
+    '''
+    t1 = vs.vec_table
+    t2 = vs.doc_table
+    t3 = vs.src_table
+    q = (sa.values(sa.column("idx", sa.Integer), sa.column("embedding", t1.c.embedding.type), name="q")
+         .data(list(enumerate(vectors))))
+    # parameters of VALUES are untyped
+    score = getattr(t1.c.embedding, strategy)(sa.cast(q.c.embedding, t1.c.embedding.type)).label("score")
+    knn = (sa.select(score, *vs._doc_columns(columns))
+           .select_from(t1)
+           .outerjoin(t2, t1.c.doc_id==t2.c.id)
+           .outerjoin(t3, t2.c.src_id==t3.c.id)
+           .where(*filters)
+           .order_by(score)
+           .limit(top_k)
+           .lateral("knn"))
+    return (sa.select(q.c.idx, knn)
+            .select_from(q.join(knn, sa.true()))
+            .order_by(q.c.idx, knn.c.score))
+
+
+def _rows_by_query(rows: t.Iterable[sa.Row], size: int) -> t.List[t.List[t.Dict]]:
+    '''
+    group rows of (idx, ...) by idx
+    '''
+    res = [[] for _ in range(size)]
+    for row in rows:
+        x = row._asdict()
+        res[x.pop("idx")].append(x)
+    return res
+
+
 class PostgresVectorStore(BaseVectorStore):
     def search_by_vector(
         self,
         query: str | t.List[float],
         top_k: int = 3,
         score_threshold: float | None = None,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
         strategy: _PGV_STRATEGY = "l2_distance",
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
         if isinstance(query, str):
             assert self.embedding_func is not None
             query = self.embedding_func(query)
 
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         with self.connect() as con:
             t1 = self.vec_table
             t2 = self.doc_table
             t3 = self.src_table
-            stmt = (sa.select(getattr(t1.c.embedding, strategy)(query).label("score"), t2)
+            stmt = (sa.select(getattr(t1.c.embedding, strategy)(query).label("score"), *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.doc_id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
                     .order_by("score")
+                    .limit(limit))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
+            docs = [x._asdict() for x in con.execute(stmt)]
+        if score_threshold is not None:
+            docs = [x for x in docs if x["score"] <= score_threshold]
+        return docs
+
+    def search_similar_to(
+        self,
+        doc_id: str,
+        top_k: int = 3,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        strategy: _PGV_STRATEGY = "l2_distance",
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.Dict]:
+        '''
+        the stored vector is an uncorrelated subquery, so indexes of the vector column can be used.
+        '''
+        filters = self.make_filters(filters)
+        with self.connect() as con:
+            t1 = self.vec_table
+            t2 = self.doc_table
+            t3 = self.src_table
+            v = t1.alias("seed")
+            seed = sa.select(v.c.embedding).where(v.c.doc_id==doc_id)
+            score = getattr(t1.c.embedding, strategy)(seed.scalar_subquery()).label("score")
+            stmt = (sa.select(score, *self._doc_columns(columns))
+                    .outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters)
+                    .where(sa.exists(seed), t1.c.doc_id!=doc_id)
+                    .order_by(score)
                     .limit(top_k))
             docs = [x._asdict() for x in con.execute(stmt)]
         if score_threshold is not None:
@@ -50,82 +147,97 @@ class PostgresVectorStore(BaseVectorStore):
         query: str,
         top_k: int = 3,
         score_threshold: float = 2,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         with self.connect() as con:
             t1 = self.fts_table
             t2 = self.doc_table
             t3 = self.src_table
             # make rank negative to compatible with sqlite fts
             rank = (-sa.func.ts_rank(t1.c.tsv, sa.func.to_tsquery(query))).label("score")
-            stmt = (sa.select(rank, t2)
+            stmt = (sa.select(rank, *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
                     .order_by(rank)
-                    .limit(top_k))
+                    .limit(limit))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
             docs = [x._asdict() for x in con.execute(stmt)]
         if score_threshold is not None:
             docs = [x for x in docs if x["score"] <= score_threshold]
         return docs
 
-    def add_document(
-        self,
-        *,
-        src_id: str,
-        content: str,
-        embedding: t.List[float] | None = None,
-        metadata: dict = {},
-        type: str | None = None,
-        seq: int = -1,
-        target_ids: list[str] = [],
-    ) -> str:
-        '''
-        insert a document chunk to database, generate fts & vectors automatically
-        '''
-        doc_id = super().add_document(
-            src_id=src_id,
-            content=content,
-            embedding=embedding,
-            metadata=metadata,
-            type=type,
-            seq=seq,
-            target_ids=target_ids,
-        )
-        # add tsvector
-        with self.connect() as con:
-            t = self.fts_table
-            if callable(self.fts_tokenize):
-                tsv = self.fts_tokenize(content)
-            else:
-                stmt = f"select to_tsvector('{self.fts_language}', '{content}');"
-                tsv = con.execute(sa.text(stmt)).scalar()
-            stmt = sa.insert(t).values(id=doc_id, tsv=tsv)
-            con.execute(stmt)
-            con.commit()
-        return doc_id
-
-    def upsert_document(self, data: dict) -> str:
-        doc_id = super().upsert_document(data)
-        if content := data.get("content"):
-            with self.connect() as con:
-                t = self.fts_table
-                stmt = (sa.update(t)
-                        .where(t.c.id==doc_id)
-                        .values(id=doc_id, content=content))
-                con.execute(stmt)
-                con.commit()
-        return doc_id
-
-
-    def delete_document(self, id: str) -> t.Tuple[int, int]:
+    def _insert_fts(self, con: sa.Connection, docs: t.List[t.Dict]):
         '''
-        delete a document chunk and it's vectors
+        insert tsvector of documents
         '''
-        res = super().delete_document(id)
-        with self.connect() as con:
-            t = self.fts_table
-            stmt = sa.delete(t).where(t.c.id==id)
-            con.execute(stmt)
-            con.commit()
-        return res
+        if not docs:
+            return
+        t = self.fts_table
+        if callable(self.fts_tokenize):
+            tsv = _batch_tokenize(self.fts_tokenize)([x["content"] for x in docs])
+            con.execute(sa.insert(t), [{"id": x["id"], "tsv": y} for x, y in zip(docs, tsv)])
+        else:
+            stmt = sa.insert(t).values(tsv=sa.func.to_tsvector(self.fts_language, sa.bindparam("content")))
+            con.execute(stmt, docs)
+
+    def _update_fts(self, con: sa.Connection, docs: t.List[t.Dict]):
+        t = self.fts_table
+        con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.id, [x["id"] for x in docs])))
+        self._insert_fts(con, docs)
+
+    def _vector_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        strategy: _PGV_STRATEGY = "l2_distance",
+    ) -> sa.Select:
+        t1 = self.vec_table
+        score = getattr(t1.c.embedding, strategy)(query).label("score")
+        stmt = sa.select(t1.c.doc_id.label("id"), score)
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        return stmt.order_by(score).limit(fetch_k)
+
+    def _bm25_candidates(
+        self,
+        query: str,
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select | None:
+        t1 = self.fts_table
+        tsquery = sa.func.to_tsquery(query)
+        rank = (-sa.func.ts_rank(t1.c.tsv, tsquery)).label("score")
+        stmt = sa.select(t1.c.id, rank)
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        # only matched documents are candidates, which can use the gin index
+        return stmt.where(t1.c.tsv.bool_op("@@")(tsquery)).order_by(rank).limit(fetch_k)
+
+    def _search_vector_batch(
+        self,
+        con: sa.Connection,
+        vectors: t.List[t.List[float]],
+        top_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        columns: t.List[str] | None = None,
+        strategy: _PGV_STRATEGY = "l2_distance",
+    ) -> t.List[t.List[t.Dict]]:
+        return _rows_by_query(con.execute(_vector_batch_stmt(self, vectors, top_k, filters, columns, strategy)), len(vectors))
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 import typing as t
 
 import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from .base_async import AsyncBaseVectorStore
+from .base_async import AsyncBaseVectorStore, _lazy_init
+from .base import _group_limits, _grouped_select
+from .postgres import _batch_tokenize, _vector_batch_stmt, _rows_by_query
 
 
 _PGV_STRATEGY = t.Literal[
@@ -18,114 +22,175 @@ _PGV_STRATEGY = t.Literal[
 
 
 class AsyncPostgresVectorStore(AsyncBaseVectorStore):
+    @_lazy_init
     async def search_by_vector(
         self,
         query: str | t.List[float],
         top_k: int = 3,
         score_threshold: float | None = None,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
         strategy: _PGV_STRATEGY = "l2_distance",
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
         if isinstance(query, str):
             assert self.embedding_func is not None
             query = await self.embedding_func(query)
 
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         async with self.connect() as con:
             t1 = self.vec_table
             t2 = self.doc_table
             t3 = self.src_table
-            stmt = (sa.select(getattr(t1.c.embedding, strategy)(query).label("score"), t2)
+            stmt = (sa.select(getattr(t1.c.embedding, strategy)(query).label("score"), *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.doc_id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
                     .order_by("score")
+                    .limit(limit))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
+            docs = [x._asdict() for x in (await con.execute(stmt))]
+        if score_threshold is not None:
+            docs = [x for x in docs if x["score"] <= score_threshold]
+        return docs
+
+    @_lazy_init
+    async def search_similar_to(
+        self,
+        doc_id: str,
+        top_k: int = 3,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        strategy: _PGV_STRATEGY = "l2_distance",
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.Dict]:
+        '''
+        the stored vector is an uncorrelated subquery, so indexes of the vector column can be used.
+        '''
+        filters = self.make_filters(filters)
+        async with self.connect() as con:
+            t1 = self.vec_table
+            t2 = self.doc_table
+            t3 = self.src_table
+            v = t1.alias("seed")
+            seed = sa.select(v.c.embedding).where(v.c.doc_id==doc_id)
+            score = getattr(t1.c.embedding, strategy)(seed.scalar_subquery()).label("score")
+            stmt = (sa.select(score, *self._doc_columns(columns))
+                    .outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters)
+                    .where(sa.exists(seed), t1.c.doc_id!=doc_id)
+                    .order_by(score)
                     .limit(top_k))
             docs = [x._asdict() for x in (await con.execute(stmt))]
         if score_threshold is not None:
             docs = [x for x in docs if x["score"] <= score_threshold]
         return docs
 
+    @_lazy_init
     async def search_by_bm25(
         self,
         query: str,
         top_k: int = 3,
         score_threshold: float = 2,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         async with self.connect() as con:
             t1 = self.fts_table
             t2 = self.doc_table
             t3 = self.src_table
             # make rank negative to compatible with sqlite fts
             rank = (-sa.func.ts_rank(t1.c.tsv, sa.func.to_tsquery(query))).label("score")
-            stmt = (sa.select(rank, t2)
+            stmt = (sa.select(rank, *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
                     .order_by(rank)
-                    .limit(top_k))
+                    .limit(limit))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
             docs = [x._asdict() for x in (await con.execute(stmt))]
         if score_threshold is not None:
             docs = [x for x in docs if x["score"] <= score_threshold]
         return docs
 
-    async def add_document(
-        self,
-        *,
-        src_id: str,
-        content: str,
-        embedding: t.List[float] | None = None,
-        metadata: dict = {},
-        type: str | None = None,
-        seq: int = -1,
-        target_ids: list[str] = [],
-    ) -> str:
+    async def _insert_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
         '''
-        insert a document chunk to database, generate fts & vectors automatically
+        insert tsvector of documents
         '''
-        doc_id = await super().add_document(
-            src_id=src_id,
-            content=content,
-            embedding=embedding,
-            metadata=metadata,
-            type=type,
-            seq=seq,
-            target_ids=target_ids,
-        )
-        # add tsvector
-        async with self.connect() as con:
-            t = self.fts_table
-            if callable(self.fts_tokenize):
-                tsv = self.fts_tokenize(content)
-            else:
-                stmt = f"select to_tsvector('{self.fts_language}', '{content}');"
-                tsv = (await con.execute(sa.text(stmt))).scalar()
-            stmt = sa.insert(t).values(id=doc_id, tsv=tsv)
-            await con.execute(stmt)
-            await con.commit()
-        return doc_id
+        if not docs:
+            return
+        t = self.fts_table
+        if callable(self.fts_tokenize):
+            # tokenize in a thread to not block the event loop
+            tsv = await asyncio.get_running_loop().run_in_executor(
+                None, _batch_tokenize(self.fts_tokenize), [x["content"] for x in docs])
+            await con.execute(sa.insert(t), [{"id": x["id"], "tsv": y} for x, y in zip(docs, tsv)])
+        else:
+            stmt = sa.insert(t).values(tsv=sa.func.to_tsvector(self.fts_language, sa.bindparam("content")))
+            await con.execute(stmt, docs)
 
-    async def upsert_document(self, data: dict) -> str:
-        doc_id = await super().upsert_document(data)
-        if content := data.get("content"):
-            async with self.connect() as con:
-                t = self.fts_table
-                stmt = (sa.update(t)
-                        .where(t.c.id==doc_id)
-                        .values(id=doc_id, content=content))
-                await con.execute(stmt)
-                await con.commit()
-        return doc_id
+    async def _update_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        t = self.fts_table
+        await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.id, [x["id"] for x in docs])))
+        await self._insert_fts(con, docs)
 
+    def _vector_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        strategy: _PGV_STRATEGY = "l2_distance",
+    ) -> sa.Select:
+        t1 = self.vec_table
+        score = getattr(t1.c.embedding, strategy)(query).label("score")
+        stmt = sa.select(t1.c.doc_id.label("id"), score)
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        return stmt.order_by(score).limit(fetch_k)
 
-    async def delete_document(self, id: str) -> t.Tuple[int, int]:
-        '''
-        delete a document chunk and it's vectors
-        '''
-        res = await super().delete_document(id)
-        async with self.connect() as con:
-            t = self.fts_table
-            stmt = sa.delete(t).where(t.c.id==id)
-            await con.execute(stmt)
-            await con.commit()
-        return res
+    def _bm25_candidates(
+        self,
+        query: str,
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select | None:
+        t1 = self.fts_table
+        tsquery = sa.func.to_tsquery(query)
+        rank = (-sa.func.ts_rank(t1.c.tsv, tsquery)).label("score")
+        stmt = sa.select(t1.c.id, rank)
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        # only matched documents are candidates, which can use the gin index
+        return stmt.where(t1.c.tsv.bool_op("@@")(tsquery)).order_by(rank).limit(fetch_k)
+
+    async def _search_vector_batch(
+        self,
+        con: AsyncConnection,
+        vectors: t.List[t.List[float]],
+        top_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        columns: t.List[str] | None = None,
+        strategy: _PGV_STRATEGY = "l2_distance",
+    ) -> t.List[t.List[t.Dict]]:
+        return _rows_by_query(await con.execute(_vector_batch_stmt(self, vectors, top_k, filters, columns, strategy)), len(vectors))
@@ -1,58 +1,262 @@
 from __future__ import annotations
 
+import asyncio
 import typing as t
 
 import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from .base_async import AsyncBaseVectorStore
+from sqlalchemy_vectorstores.databases.sqlite import _fts_query
+from sqlalchemy_vectorstores.tokenizers.base import BaseTokenize
+from .base import _group_limits, _grouped_select
+from .base_async import AsyncBaseVectorStore, _lazy_init
+
+if t.TYPE_CHECKING:
+    import numpy as np
 
 
 class AsyncSqliteVectorStore(AsyncBaseVectorStore):
+    @property
+    def pretokenized(self) -> bool:
+        '''
+        whether fts content is tokenized in python by `fts_tokenize`, a `BaseTokenize` instance
+        '''
+        return isinstance(self.fts_tokenize, BaseTokenize)
+
+    def _doc_rowids(self, ids: t.List[str]) -> sa.Select:
+        t = self.doc_table
+        return sa.select(sa.literal_column("rowid")).select_from(t).where(self.db.make_ids_filter(t.c.id, ids))
+
+    async def _delete_documents(self, con: AsyncConnection, ids: t.List[str]) -> t.Tuple[int, int, int]:
+        '''
+        fts rows of documents are deleted by triggers of the external content table,
+        or by rowid of documents if pretokenized.
+        '''
+        if self.use_edge_table:
+            await self._delete_edges(con, ids)
+        fts_count = None
+        if self.pretokenized:
+            t = self.fts_table
+            fts_count = (await con.execute(sa.delete(t).where(t.c.rowid.in_(self._doc_rowids(ids))))).rowcount
+        t = self.doc_table
+        doc_count = (await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.id, ids)))).rowcount
+        t = self.vec_table
+        vec_count = (await con.execute(sa.delete(t).where(self.db.make_ids_filter(t.c.doc_id, ids)))).rowcount
+        return doc_count, vec_count, doc_count if fts_count is None else fts_count
+
+    async def _insert_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        '''
+        insert space joined tokens of documents if pretokenized, with rowid same as the document.
+        '''
+        if self.pretokenized and docs:
+            t = self.doc_table
+            stmt = (sa.select(t.c.id, sa.literal_column("rowid"))
+                    .where(self.db.make_ids_filter(t.c.id, [x["id"] for x in docs])))
+            rowids = dict((await con.execute(stmt)).all())
+            # tokenize in a thread to not block the event loop
+            texts = await asyncio.get_running_loop().run_in_executor(
+                None, self.fts_tokenize.batch_to_fts_text, [x["content"] or "" for x in docs])
+            rows = [{"rowid": rowids[x["id"]], "id": x["id"], "content": y} for x, y in zip(docs, texts)]
+            await con.execute(sa.insert(self.fts_table), rows)
+
+    async def _update_fts(self, con: AsyncConnection, docs: t.List[t.Dict]):
+        if self.pretokenized and docs:
+            t = self.fts_table
+            await con.execute(sa.delete(t).where(t.c.rowid.in_(self._doc_rowids([x["id"] for x in docs]))))
+            await self._insert_fts(con, docs)
+
+    @_lazy_init
+    async def reindex_documents(self, words: t.List[str] | None = None, chunk_size: int = 500) -> int:
+        '''
+        fts table synced by triggers is tokenized by sqlite, so it's rebuilt entirely.
+        '''
+        if self.pretokenized:
+            return await super().reindex_documents(words, chunk_size)
+
+        async with self.connect() as con:
+            t = self.fts_table
+            await con.execute(sa.text(f"INSERT INTO [{t.name}]([{t.name}]) VALUES('rebuild')"))
+            count = (await con.execute(sa.select(sa.func.count()).select_from(self.doc_table))).scalar()
+            await con.commit()
+        return count
+
+    @_lazy_init
     async def search_by_vector(
         self,
         query: str | t.List[float],
         top_k: int = 3,
         score_threshold: float | None = None,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
         if isinstance(query, str):
             assert self.embedding_func is not None
             query = await self.embedding_func(query)
 
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         async with self.connect() as con:
             t1 = self.vec_table
             t2 = self.doc_table
             t3 = self.src_table
-            stmt = (sa.select(t1.c.distance.label("score"), t2)
+            stmt = (sa.select(t1.c.distance.label("score"), *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.doc_id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
-                    .where(t1.c.embedding.match(query), sa.text(f"k={top_k}")))
+                    .where(t1.c.embedding.match(query), sa.text(f"k={limit}")))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
             docs = [x._asdict() for x in (await con.execute(stmt))]
         if score_threshold is not None:
             docs = [x for x in docs if x["score"] <= score_threshold]
         return docs
 
+    @_lazy_init
+    async def search_similar_to(
+        self,
+        doc_id: str,
+        top_k: int = 3,
+        score_threshold: float | None = None,
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.Dict]:
+        '''
+        vec0 matches the stored blob of the document. if it has no vector, a zero vector keeps MATCH valid
+        and the EXISTS guard returns no rows.
+        '''
+        filters = self.make_filters(filters)
+        async with self.connect() as con:
+            t1 = self.vec_table
+            t2 = self.doc_table
+            t3 = self.src_table
+            v = t1.alias("seed")
+            seed = sa.select(v.c.embedding).where(v.c.doc_id==doc_id)
+            query = sa.func.coalesce(seed.scalar_subquery(), sa.func.zeroblob(self.dim * 4))
+            # the document itself is the nearest one
+            stmt = (sa.select(t1.c.distance.label("score"), *self._doc_columns(columns))
+                    .outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters)
+                    .where(sa.exists(seed), t1.c.embedding.match(query), sa.text(f"k={top_k + 1}"),
+                           t1.c.doc_id!=doc_id))
+            docs = [x._asdict() for x in (await con.execute(stmt))]
+        if score_threshold is not None:
+            docs = [x for x in docs if x["score"] <= score_threshold]
+        return docs[:top_k]
+
+    @_lazy_init
     async def search_by_bm25(
         self,
         query: str,
         top_k: int = 3,
         score_threshold: float = 2,
-        filters: list[sa.sql._typing.ColumnExpressionArgument] = [],
+        filters: list[sa.sql._typing.ColumnExpressionArgument | t.Dict] | t.Dict = [],
+        columns: t.List[str] | None = None,
+        group_by: str | None = None,
+        per_group: int = 1,
+        max_groups: int | None = None,
+        fetch_k: int | None = None,
     ) -> t.List[t.Dict]:
+        if self.pretokenized:
+            query = _fts_query(query, self.fts_tokenize.lcut_words)
+            if not query:
+                return []
+        filters = self.make_filters(filters)
+        limit, max_groups = _group_limits(top_k, fetch_k, group_by, per_group, max_groups)
         async with self.connect() as con:
             t1 = self.fts_table
             t2 = self.doc_table
             t3 = self.src_table
             rank = t1.c.rank.label("score")
-            stmt = (sa.select(rank, t2)
+            stmt = (sa.select(rank, *self._doc_columns(columns, group_by))
                     .outerjoin(t2, t1.c.id==t2.c.id)
                     .outerjoin(t3, t2.c.src_id==t3.c.id)
                     .where(*filters)
                     .where(sa.text(f"{t1.name} match :query"))
                     .order_by(rank)
-                    .limit(top_k))
-            docs = [x._asdict() for x in (await con.execute(stmt, query=query))]
+                    .limit(limit))
+            if group_by:
+                stmt = _grouped_select(stmt, group_by, per_group, max_groups)
+            docs = [x._asdict() for x in (await con.execute(stmt, {"query": query}))]
         if score_threshold is not None:
             docs = [x for x in docs if x["score"] <= score_threshold]
         return docs
+
+    def _vector_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select:
+        t1 = self.vec_table
+        stmt = sa.select(t1.c.doc_id.label("id"), t1.c.distance.label("score"))
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.doc_id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        return stmt.where(t1.c.embedding.match(query), sa.text(f"k={fetch_k}"))
+
+    def _mmr_candidates(
+        self,
+        query: t.List[float],
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select:
+        '''
+        embeddings are selected as float32 blobs of vec0, not decoded to lists of floats.
+        '''
+        embedding = sa.type_coerce(self.vec_table.c.embedding, sa.LargeBinary).label("embedding")
+        return self._vector_candidates(query, fetch_k, filters).add_columns(embedding)
+
+    def _embedding_matrix(self, values: t.List[bytes]) -> np.ndarray:
+        import numpy as np
+        return np.frombuffer(b"".join(values), dtype=np.float32).reshape(len(values), -1)
+
+    def _bm25_candidates(
+        self,
+        query: str,
+        fetch_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+    ) -> sa.Select | None:
+        if self.pretokenized:
+            query = _fts_query(query, self.fts_tokenize.lcut_words)
+            if not query:
+                return None
+        t1 = self.fts_table
+        rank = t1.c.rank.label("score")
+        stmt = sa.select(t1.c.id, rank)
+        if filters:
+            t2 = self.doc_table
+            t3 = self.src_table
+            stmt = (stmt.outerjoin(t2, t1.c.id==t2.c.id)
+                    .outerjoin(t3, t2.c.src_id==t3.c.id)
+                    .where(*filters))
+        return (stmt.where(sa.text(f"{t1.name} match :fts_query").bindparams(fts_query=query))
+                .order_by(rank)
+                .limit(fetch_k))
+
+    async def _search_vector_batch(
+        self,
+        con: AsyncConnection,
+        vectors: t.List[t.List[float]],
+        top_k: int,
+        filters: t.List[sa.sql._typing.ColumnExpressionArgument],
+        columns: t.List[str] | None = None,
+    ) -> t.List[t.List[t.Dict]]:
+        # vec0 knn takes one vector, the statement is prepared once and executed per vector
+        t1 = self.vec_table
+        t2 = self.doc_table
+        t3 = self.src_table
+        stmt = (sa.select(t1.c.distance.label("score"), *self._doc_columns(columns))
+                .outerjoin(t2, t1.c.doc_id==t2.c.id)
+                .outerjoin(t3, t2.c.src_id==t3.c.id)
+                .where(*filters)
+                .where(t1.c.embedding.match(sa.bindparam("embedding", type_=t1.c.embedding.type)),
+                       sa.text(f"k={top_k}")))
+        return [[x._asdict() for x in (await con.execute(stmt, {"embedding": v}))] for v in vectors]
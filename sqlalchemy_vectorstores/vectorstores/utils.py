@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import enum
+import re
 import typing as t
 
 import sqlalchemy as sa
@@ -14,6 +15,17 @@ def _select_first_to_dict(result: sa.ResultProxy) -> dict | None:
         return {k:v for k,v in zip(result.keys(), data)}
 
 
+# a CJK character or a run of other word characters
+_WORD_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[^\W\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def _count_words(text: str) -> int:
+    '''
+    approximate words of text without a tokenizer, every CJK character is a word
+    '''
+    return len(_WORD_PATTERN.findall(text or ""))
+
+
 class Document(t.TypedDict):
     src_id: str
     content: str
@@ -23,6 +35,15 @@ class Document(t.TypedDict):
     target_ids: list[str]
 
 
+# default values of document fields, same as add_document
+_DOC_DEFAULTS = {
+    "metadata": {},
+    "type": None,
+    "seq": -1,
+    "target_ids": [],
+}
+
+
 class DocType(str, enum.Enum):
     ORIGIN = "origin"
     SUMMARY = "summary"
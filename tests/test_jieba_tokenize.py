@@ -25,6 +25,46 @@ def test_tokenize():
     assert "'sqlalchemy-vectores':1" in r
 
 
+def test_lazy_init(tmp_path):
+    tokenize = JiebaTokenize(user_dict=["sqlalchemy-vectores"], cache_file=str(tmp_path / "jieba.cache"), background=True)
+    r = tokenize.lcut_words("sqlalchemy-vectores 是一个向量检索库")
+    print(r)
+    assert tokenize._initialized
+    assert "sqlalchemy-vectores" in r
+
+
+def test_stop_words():
+    tokenize = JiebaTokenize(stop_words=["的", "Is"], skip_patterns=[r"\s+", r"\d+$"], hmm=False)
+    r = tokenize.lcut_words("This Is 一个 sqlite 的库 2024")
+    print(r)
+    assert r == ["this", "一个", "sqlite", "库"]
+
+
+def test_batch_to_tsvector():
+    texts = [f"第{i}部分：sqlalchemy 利用 sqlite 和 postgres 数据库实现向量检索" for i in range(20)]
+    tokenize = JiebaTokenize(processes=2, min_batch_size=10)
+    r = tokenize.batch_to_tsvector(texts)
+    tokenize.close()
+    print(r[:2])
+    assert r == [tokenize.as_pg_tokenize()(x) for x in texts]
+
+
+def test_cache():
+    tokenize = JiebaTokenize(stop_words=["的"])
+    query = "核电厂定期安全审查的要素"
+    r = tokenize.cut_for_search(query)
+    assert tokenize.cut_for_search(query) == r
+    assert tokenize.cache_stats()["hits"] == 1
+
+    tokenize.set_stop_words(["核电厂"])
+    assert tokenize.cache_stats()["size"] == 0
+    assert "核电厂" not in tokenize.lcut_words(query)
+
+    # only query-sized texts are cached
+    tokenize.lcut_words(query * 10)
+    assert tokenize.cache_stats()["size"] == 1
+
+
 def test_sqlite_fts():
     texts = [
         """NB/T20513一2018《核电厂定期安全审查指南》分为15个部分：
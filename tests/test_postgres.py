@@ -31,6 +31,15 @@ sentences2 = [
 ]
 
 
+def test_indexes():
+    r = vs.list_indexes()
+    print(r)
+    names = [x["name"] for x in r[vs.doc_table.name]]
+    assert f"idx_{vs.doc_table.name}_src_id_seq" in names
+    assert f"idx_{vs.doc_table.name}_type" in names
+    assert vs.ensure_indexes() == []
+
+
 def test_create():
     # add sources
     print("add sources")
@@ -1,9 +1,12 @@
+import threading
+
 import pytest
 
 import openai
 from rich import print
 import sqlalchemy as sa
 from sqlalchemy_vectorstores import SqliteDatabase, SqliteVectorStore
+from sqlalchemy_vectorstores.retrievers import BaseRetriever
 from sqlalchemy_vectorstores.tokenizers.jieba_tokenize import JiebaTokenize
 
 
@@ -46,6 +49,15 @@ def test_version():
         print(f"{vec_version=}")
 
 
+def test_indexes():
+    r = vs.list_indexes()
+    print(r)
+    names = [x["name"] for x in r[vs.doc_table.name]]
+    assert f"idx_{vs.doc_table.name}_src_id_seq" in names
+    assert f"idx_{vs.doc_table.name}_type" in names
+    assert vs.ensure_indexes() == []
+
+
 def test_create():
     # add sources
     print("add sources")
@@ -144,3 +156,431 @@ def test_create():
     r = vs.search_by_bm25(query)
     print(r)
     assert query in r[0]["content"]
+
+
+def test_metadata_index():
+    name = vs.create_metadata_index("path", table="src")
+    expr = vs.db.make_filter(vs.src_table.c.metadata, "path2", "dict", "$.path")
+    r = vs.search_sources(expr)
+    print(r)
+    assert len(r) == 1
+
+    with vs.connect() as con:
+        stmt = vs.src_table.select().where(expr).compile(con, compile_kwargs={"literal_binds": True})
+        plan = con.execute(sa.text(f"explain query plan {stmt}")).all()
+        print(plan)
+        assert name in str(plan)
+
+    # "_" is compared exactly, not as a LIKE wildcard
+    expr = vs.db.make_filter(vs.src_table.c.metadata, "pat_2", "dict", "$.path")
+    assert vs.search_sources(expr) == []
+    with vs.connect() as con:
+        stmt = vs.src_table.select().where(expr).compile(con, compile_kwargs={"literal_binds": True})
+        assert name in str(con.execute(sa.text(f"explain query plan {stmt}")).all())
+
+
+def test_tag_table():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="tagged", use_tag_table=True)
+    src_id1 = vs2.add_source(src="file1.pdf", tags=["a", "b"])
+    src_id2 = vs2.add_source(src="file2.pdf", tags=["ab", "b"])
+
+    r = vs2.get_sources_by_tags(tags_any=["a"])
+    print(r)
+    assert [x["id"] for x in r] == [src_id1]
+
+    r = vs2.get_sources_by_tags(tags_all=["b", "ab"])
+    assert [x["id"] for x in r] == [src_id2]
+
+    vs2.upsert_source({"id": src_id2, "tags": ["a"]})
+    r = vs2.get_sources_by_tags(tags_any=["a"], tags_all=["a"])
+    assert len(r) == 2
+
+    vs2.delete_source(src_id1)
+    assert vs2.sync_tag_table() == 1
+
+
+def test_edge_table():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="edge", use_edge_table=True)
+    src_id = vs2.add_source(src="file1.pdf")
+    ids = vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1])
+    q1 = vs2.add_document(src_id=src_id, content="question 1", type="question", target_ids=ids[:2])
+    q2 = vs2.add_document(src_id=src_id, content="question 2", type="question", target_ids=ids[1:2])
+
+    hits = [{"id": q2, "score": 0.1}, {"id": ids[-1], "score": 0.2}, {"id": q1, "score": 0.3}]
+    r = vs2.resolve_targets(hits, columns=["content"])
+    print(r)
+    assert [x["id"] for x in r] == [ids[1], ids[-1], ids[0]]
+    assert r[0]["hit_ids"] == [q2, q1] and r[0]["score"] == 0.1
+
+    r = vs2.get_referrers([ids[1]])
+    assert sorted(x["id"] for x in r) == sorted([q1, q2])
+
+    vs2.upsert_document({"id": q2, "target_ids": [ids[2]]})
+    assert [x["id"] for x in vs2.get_referrers([ids[2]])] == [q2]
+    vs2.delete_documents([q1])
+    assert vs2.get_referrers([ids[0]]) == []
+    assert vs2.sync_edge_table() == 1
+
+
+def test_filters():
+    r = vs.search_documents({"src": "file1.pdf"})
+    print(r)
+    assert len(r) == len(sentences1)
+
+    r = vs.search_documents({"src": "FILE1.pdf"})
+    assert len(r) == 0
+
+    filters = {"src": "file1.pdf", "src.metadata.path": {"$in": ["path1", "path2"]}}
+    r = vs.search_by_vector(query, filters=filters)
+    print(r)
+    assert query in r[0]["content"]
+
+    filters = {"$or": [{"src": "file1.pdf"}, {"tags": {"$all": ["b", "c"]}}]}
+    r = vs.search_by_bm25(query, filters=filters)
+    print(r)
+    assert query in r[0]["content"]
+
+
+def test_delete_where():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="deleted", use_tag_table=True)
+    src_id1 = vs2.add_source(src="file1.pdf", tags=["a"])
+    src_id2 = vs2.add_source(src="file2.pdf", tags=["b"])
+    for i, x in enumerate(sentences1):
+        vs2.add_document(src_id=src_id1, content=x, metadata={"i": i})
+    for i, x in enumerate(sentences2):
+        vs2.add_document(src_id=src_id2, content=x, metadata={"i": i})
+
+    r = vs2.delete_where({"metadata.i": {"$gte": 1}}, chunk_size=2)
+    print(r)
+    assert r == (4, 4, 4)
+    assert len(vs2.search_documents()) == 2
+
+    with pytest.raises(RuntimeError):
+        vs2.delete_where({})
+    with pytest.raises(RuntimeError):
+        vs2.delete_where({"$and": []})
+    # an empty $or matches nothing instead of every document
+    assert vs2.search_documents({"$or": []}) == []
+    assert vs2.delete_where({"$or": []}) == (0, 0, 0)
+    assert len(vs2.search_documents({"$and": []})) == 2
+
+    r = vs2.delete_source_by_src(["file1.pdf", "file2.pdf"])
+    assert r == (2, 2, 2)
+    assert vs2.search_sources() == []
+    assert vs2.sync_tag_table() == 0
+
+
+def test_delete_source(monkeypatch):
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, table_prefix="delete_source")
+    src_id = vs2.add_source(src="file1.pdf")
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1])
+
+    def fail(con, src_ids):
+        raise RuntimeError("failed to delete sources")
+
+    # documents of the last chunk are rolled back with the source
+    monkeypatch.setattr(vs2, "_delete_sources", fail)
+    with pytest.raises(RuntimeError):
+        vs2.delete_source(src_id)
+    assert len(vs2.get_documents_of_source(src_id)) == len(sentences1)
+
+    monkeypatch.undo()
+    assert vs2.delete_source(src_id) == (len(sentences1),) * 3
+    assert vs2.get_source_by_id(src_id) is None
+
+
+def test_ids_filter():
+    docs = vs.search_documents()
+    ids = [x["id"] for x in docs] + [f"fake-{i}" for i in range(db.max_in_ids * 100)]
+    r = vs.get_document_by_ids(ids)
+    assert len(r) == len(docs)
+
+    src_ids = [x["src_id"] for x in docs[:1]] + ids
+    r = vs.search_by_bm25(query, filters={"src_id": {"$in": src_ids}})
+    print(r)
+    assert query in r[0]["content"]
+
+
+def test_add_documents():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="batch")
+    src_id = vs2.add_source(src="file1.pdf")
+
+    commits = []
+    def on_commit(con):
+        commits.append(1)
+    sa.event.listen(db.engine, "commit", on_commit)
+    ids = vs2.add_documents([{"src_id": src_id, "content": x, "seq": i} for i, x in enumerate(sentences1)])
+    sa.event.remove(db.engine, "commit", on_commit)
+    assert len(commits) == 1
+    assert len(vs2.get_document_by_ids(ids)) == len(sentences1)
+
+    r = vs2.search_by_bm25(query)
+    print(r)
+    assert query in r[0]["content"]
+
+    doc_id = vs2.upsert_document({"id": ids[0], "content": "sqlalchemy-vectorstores"})
+    assert doc_id == ids[0]
+    r = vs2.search_by_bm25("sqlalchemy")
+    assert r[0]["id"] == ids[0]
+
+
+def test_embedding_calls():
+    calls = []
+    def embed_one(text):
+        calls.append(text.strip())
+        return embed_func(text)
+    def embed_batch(texts):
+        calls.append(list(texts))
+        return [embed_func(x) for x in texts]
+
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_one, table_prefix="embed_calls")
+    src_id = vs2.add_source(src="file1.pdf")
+    vs2.add_document(src_id=src_id, content=sentences1[0])
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1])
+    assert calls == [sentences1[0]] + sentences1
+
+    calls.clear()
+    vs2.batch_embedding_func = embed_batch
+    vs2.add_document(src_id=src_id, content=sentences1[0])
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1])
+    vs2.search_by_vector_batch(sentences2)
+    assert calls == [sentences1[0], sentences1, sentences2]
+
+
+def test_manifest():
+    vs2 = SqliteVectorStore(db, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="manifest", embedding_model=EMBEDDING_MODEL)
+    assert vs2.dim == 1024
+    vs2.create_metadata_index("path")
+
+    statements = []
+    def on_execute(con, cursor, statement, *args):
+        statements.append(statement)
+    sa.event.listen(db.engine, "before_cursor_execute", on_execute)
+    vs3 = SqliteVectorStore(db, embedding_func=embed_func, fts_tokenize="jieba",
+                            table_prefix="manifest", embedding_model=EMBEDDING_MODEL)
+    sa.event.remove(db.engine, "before_cursor_execute", on_execute)
+    print(statements)
+    assert len(statements) == 1
+    assert vs3.dim == 1024
+    assert (vs3.doc_table.name, "$.path") in db._metadata_indexes
+
+    with pytest.raises(RuntimeError):
+        SqliteVectorStore(db, embedding_func=embed_func, fts_tokenize="jieba",
+                          table_prefix="manifest", embedding_model="other-model")
+
+
+def test_pretokenized():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize=JiebaTokenize(),
+                            table_prefix="pretokenized")
+    assert vs2.pretokenized
+    src_id = vs2.add_source(src="file1.pdf")
+    ids = vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1 + sentences2])
+
+    r = vs2.search_by_bm25(query)
+    print(r)
+    assert query in r[0]["content"]
+    r = vs2.search_by_bm25("向量检索 OR 全文检索")
+    assert r[0]["content"] == sentences2[2]
+
+    vs2.delete_documents(ids[-1:])
+    assert vs2.search_by_bm25("向量检索") == []
+
+
+def test_sync_tokenizer():
+    tokenize = JiebaTokenize()
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize=tokenize,
+                            table_prefix="words")
+    src_id = vs2.add_source(src="file1.pdf")
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences2])
+
+    version = vs2.upsert_words(["sqlalchemy-vectores", "向量检索"])
+    vs2.upsert_words(["的"], status=0)
+    words = vs2.sync_tokenizer(reindex=True)
+    print(words)
+    assert words == ["sqlalchemy-vectores", "向量检索", "的"]
+    assert tokenize.words_version == version + 1
+    assert "的" not in tokenize.lcut_words(sentences2[2])
+    r = vs2.search_by_bm25("向量检索")
+    assert r[0]["content"] == sentences2[2]
+
+    vs2.delete_words(["的"])
+    assert vs2.sync_tokenizer() == ["的"]
+    assert vs2.sync_tokenizer() == []
+
+
+def test_words_version(tmp_path):
+    # connections of a file database are separated by threads
+    db2 = SqliteDatabase(f"sqlite:///{tmp_path / 'words.db'}")
+    vs2 = SqliteVectorStore(db2, dim=1024, embedding_func=embed_func)
+    res = []
+    with vs2.connect() as con:
+        version = vs2._next_words_version(con)
+        # another writer waits for the lock instead of taking the same version
+        writer = threading.Thread(target=lambda: res.append(vs2.upsert_words(["b"])))
+        writer.start()
+        writer.join(0.5)
+        assert writer.is_alive()
+        con.execute(sa.insert(vs2.words_table).values(word="a", status=1, version=version))
+        con.commit()
+    writer.join()
+    assert res == [version + 1]
+    assert vs2.get_words_delta(version)[0][0]["word"] == "b"
+
+
+def test_search_hybrid():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize=JiebaTokenize(),
+                            table_prefix="hybrid")
+    src_id = vs2.add_source(src="file1.pdf")
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1 + sentences2])
+
+    r = vs2.search_hybrid(query, top_k=2)
+    print(r)
+    assert len(r) == 2 and query in r[0]["content"]
+    assert r[0]["score"] <= r[1]["score"]
+    r = vs2.search_hybrid("向量检索", fusion="linear", filters={"content": {"$like": "%sqlalchemy%"}})
+    assert [x["content"] for x in r] == [sentences2[2]]
+    r = vs2.search_hybrid(" ", weights=(0, 1))
+    assert r == []
+
+
+def test_retrieve():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize=JiebaTokenize(),
+                            table_prefix="retrieve")
+    src_id1 = vs2.add_source(src="file1.pdf", tags=["a"])
+    src_id2 = vs2.add_source(src="file2.pdf", tags=["b"])
+    vs2.add_documents([{"src_id": src_id1, "content": x} for x in sentences1])
+    vs2.add_documents([{"src_id": src_id2, "content": x, "type": "summary"} for x in sentences2])
+
+    retriever = BaseRetriever(vs2)
+    r = retriever.retrieve(query, top_k=2, score_threshold_bm25=None)
+    print(r)
+    assert len(r) == 2 and query in r[0]["content"]
+    assert set(r[0]["scores"]) == {"vector", "bm25"}
+    r = retriever.retrieve("向量检索", top_k=5, src_tags_any=["b"], doc_types=["summary"])
+    assert len(r) == 3 and all(x["src_id"] == src_id2 for x in r)
+    r = retriever.retrieve(query, top_k=5, max_words=20, score_threshold_bm25=None)
+    assert sum(retriever.count_words(x["content"]) for x in r) <= 20
+
+    # retrievers share the embedding threads
+    threads = threading.active_count()
+    for _ in range(3):
+        BaseRetriever(vs2).retrieve(query, top_k=2)
+    assert threading.active_count() == threads
+
+
+def test_filters_cache():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, table_prefix="filters_cache")
+    src_id = vs2.add_source(src="file1.pdf")
+    vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1])
+
+    retriever = BaseRetriever(vs2)
+    for _ in range(2):
+        retriever.retrieve(query, top_k=3, max_words=1, src_id=src_id, score_threshold_bm25=None)
+    assert len(vs2.make_filters({"src_id": src_id})) == 1
+    r = vs2.search_by_vector(query, top_k=3, filters={"src_id": src_id})
+    assert len(r) == len(sentences1)
+
+
+def test_search_by_vector_batch():
+    queries = [query, sentences2[2]]
+    r = vs.search_by_vector_batch(queries, top_k=2)
+    print(r)
+    assert len(r) == 2
+    for q, docs in zip(queries, r):
+        assert [x["id"] for x in docs] == [x["id"] for x in vs.search_by_vector(q, top_k=2)]
+    assert vs.search_by_vector_batch([]) == []
+
+
+def test_late_materialization():
+    r = vs.search_by_vector(query, top_k=3, columns=[])
+    print(r)
+    assert set(r[0]) == {"id", "score"}
+    docs = vs.fetch_documents([x["id"] for x in r], columns=["content", "embedding"])
+    assert [x["id"] for x in docs] == [x["id"] for x in r]
+    assert query in docs[0]["content"] and len(docs[0]["embedding"]) == 1024
+    r = vs.search_by_bm25(query, columns=["content"])
+    assert set(r[0]) == {"id", "score", "content"}
+
+
+def test_expand_context():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, table_prefix="context")
+    src_id = vs2.add_source(src="file1.pdf")
+    ids = vs2.add_documents([{"src_id": src_id, "content": x, "seq": i} for i, x in enumerate(sentences1 + sentences2)])
+
+    r = vs2.expand_context([ids[1], ids[3]], window=1)
+    print(r)
+    assert len(r) == 1 and r[0]["ids"] == ids[:5] and r[0]["hit_ids"] == [ids[1], ids[3]]
+    assert r[0]["content"] == "\n".join((sentences1 + sentences2)[:5])
+    r = vs2.expand_context([ids[1], ids[4]], window=1, max_words=vs2.count_words(sentences1[1]))
+    assert [x["ids"] for x in r] == [[ids[1]]]
+
+
+def test_word_count():
+    tokenize = JiebaTokenize()
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize=tokenize,
+                            table_prefix="word_count")
+    src_id = vs2.add_source(src="file1.pdf")
+    ids = vs2.add_documents([{"src_id": src_id, "content": x} for x in sentences1 + sentences2])
+    docs = vs2.fetch_documents(ids, columns=["content", "word_count"])
+    assert all(x["word_count"] == len(tokenize.lcut_words(x["content"])) for x in docs)
+
+    vs2.upsert_document({"id": ids[0], "content": "向量检索"})
+    word_count = len(tokenize.lcut_words("向量检索"))
+    assert vs2.fetch_documents(ids[:1], columns=["word_count"])[0]["word_count"] == word_count
+    r = vs2.search_documents({"word_count": {"$lte": word_count}})
+    assert [x["id"] for x in r] == ids[:1]
+
+    retriever = BaseRetriever(vs2, tokenize=tokenize)
+    max_words = docs[2]["word_count"]
+    r = retriever.retrieve(query, top_k=5, max_words=max_words, score_threshold_bm25=None)
+    print(r)
+    assert sum(x["word_count"] for x in r) <= max_words
+
+
+def test_grouped_search():
+    vs2 = SqliteVectorStore(db, dim=1024, embedding_func=embed_func, table_prefix="grouped")
+    src_ids = [vs2.add_source(src=f"file{i}.pdf") for i in range(3)]
+    vs2.add_documents([{"src_id": x, "content": y} for x in src_ids for y in sentences1 + sentences2])
+
+    # candidates of groups are not limited by top_k
+    r = vs2.search_by_vector(query, group_by="src_id", per_group=2, max_groups=2, columns=[])
+    print(r)
+    assert len(r) == 4
+    assert sorted(r[0]) == ["id", "score", "src_id"]
+    assert r[0]["src_id"] == r[1]["src_id"] != r[2]["src_id"] == r[3]["src_id"]
+    assert r[0]["score"] <= r[1]["score"] and r[0]["score"] <= r[2]["score"] <= r[3]["score"]
+
+    r = vs2.search_by_vector(query, top_k=2, group_by="src_id")
+    assert len({x["src_id"] for x in r}) == len(r) == 2
+
+    r = vs2.search_by_bm25("Japanese", score_threshold=None, group_by="src_id")
+    assert sorted(x["src_id"] for x in r) == sorted(src_ids)
+
+    r = vs2.search_hybrid(query, group_by="src_id", per_group=2, max_groups=2)
+    assert len(r) == 4
+
+
+def test_search_by_mmr():
+    r = vs.search_by_vector(query, top_k=10)
+    mmr = vs.search_by_mmr(query, top_k=3, fetch_k=10, columns=["content"])
+    print(mmr)
+    assert len(mmr) == 3 and len({x["id"] for x in mmr}) == 3
+    assert sorted(mmr[0]) == ["content", "id", "score"]
+    assert {x["id"] for x in mmr} <= {x["id"] for x in r}
+    assert vs.search_by_mmr(query, top_k=3, score_threshold=-1) == []
+
+
+def test_search_similar_to():
+    doc = vs.search_by_vector(query, top_k=1, columns=[])[0]
+    embedding = vs.fetch_documents([doc["id"]], columns=["embedding"])[0]["embedding"]
+    want = [x["id"] for x in vs.search_by_vector(embedding, top_k=4) if x["id"] != doc["id"]][:3]
+
+    r = vs.search_similar_to(doc["id"], top_k=3)
+    print(r)
+    assert [x["id"] for x in r] == want
+    assert vs.search_similar_to("not-existed") == []
@@ -145,3 +145,18 @@ async def test_create():
     r = await vs.search_by_bm25(query)
     print(r)
     assert query in r[0]["content"]
+
+
+@pytest.mark.asyncio
+async def test_create_in_loop():
+    vs2 = AsyncSqliteVectorStore(db, dim=1024, embedding_func=embed_func, fts_tokenize="jieba", table_prefix="lazy")
+    assert not vs2._initialized
+    src_id = await vs2.add_source(src="file1.pdf")
+    assert vs2._initialized
+    await vs2.add_document(src_id=src_id, content=sentences1[2])
+    r = await vs2.search_by_bm25(query)
+    print(r)
+    assert query in r[0]["content"]
+
+    vs3 = await AsyncSqliteVectorStore.create(db, embedding_func=embed_func, fts_tokenize="jieba", table_prefix="created")
+    assert vs3._initialized and vs3.dim == 1024